@@ -0,0 +1,52 @@
+"""Autorización de conversaciones resuelta en una sola consulta.
+
+Sirve tanto a las vistas síncronas como a los streams, que la usan con el ORM
+asíncrono (`afirst`) para no ocupar el pool de hilos de `sync_to_async`.
+"""
+from django.db.models import Exists, OuterRef
+from rest_framework.authtoken.models import Token
+
+from usuarios.models import Usuario
+from .models import conversacion
+
+Participante = conversacion.participantes.through
+Match = Usuario.matches.through
+
+
+def es_participante(usuario):
+    return Exists(Participante.objects.filter(conversacion_id=OuterRef("pk"), usuario_id=usuario.pk))
+
+
+def sin_match(usuario):
+    """Algún otro participante de la conversación no tiene match con `usuario`."""
+    return Exists(
+        Participante.objects.filter(conversacion_id=OuterRef("pk"))
+        .exclude(usuario_id=usuario.pk)
+        .exclude(usuario_id__in=Match.objects.filter(from_usuario_id=usuario.pk).values("to_usuario_id"))
+    )
+
+
+def conversaciones_con_acceso(usuario):
+    """Anota `es_participante` y `sin_match` para explicar por qué se niega el acceso."""
+    return conversacion.objects.annotate(es_participante=es_participante(usuario), sin_match=sin_match(usuario))
+
+
+def conversaciones_habilitadas(usuario):
+    """Conversaciones donde `usuario` puede escribir, como filtro (sirve para un UPDATE condicional)."""
+    return conversacion.objects.filter(es_participante(usuario), ~sin_match(usuario))
+
+
+async def aacceso_conversacion(usuario, conversacion_id):
+    """Devuelve {"es_participante", "sin_match"} o None si la conversación no existe."""
+    return await (
+        conversaciones_con_acceso(usuario)
+        .filter(pk=conversacion_id)
+        .values("es_participante", "sin_match")
+        .afirst()
+    )
+
+
+async def ausuario_por_token(clave):
+    """Usuario dueño del token, con la misma regla que `TokenAuthentication`: debe estar activo."""
+    token = await Token.objects.select_related("user").filter(key=clave, user__is_active=True).afirst()
+    return token.user if token is not None else None
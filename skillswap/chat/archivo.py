@@ -0,0 +1,163 @@
+"""Archivo en frío de los mensajes antiguos del chat.
+
+`archivar_mensajes` saca de `chat_mensaje` los mensajes viejos y los agrega a
+dos archivos por conversación en `CHAT_ARCHIVO_DIR`, que solo crecen:
+
+- `<id>.seg`: bloques de hasta `MENSAJES_POR_BLOQUE` mensajes, cada uno en JSON
+  comprimido con zlib.
+- `<id>.idx`: un registro de tamaño fijo por bloque (primer id, último id,
+  offset, longitud, cantidad). Se escribe después del bloque, así que un bloque
+  sin registro (por una caída a mitad de camino) simplemente no existe.
+
+Los ids archivados de una conversación son siempre menores que los que quedan en
+la tabla, de modo que el historial completo es el archivo seguido de la tabla.
+Las lecturas usan mmap y solo descomprimen los bloques que tocan.
+"""
+import bisect
+import fcntl
+import json
+import mmap
+import os
+import struct
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .models import mensaje
+
+MENSAJES_POR_BLOQUE = 128
+REGISTRO = struct.Struct("<QQQII")
+
+
+def _directorio():
+    return getattr(settings, "CHAT_ARCHIVO_DIR", os.path.join(settings.BASE_DIR, "archivo_chat"))
+
+
+class ArchivoConversacion:
+    def __init__(self, conversacion_id, directorio=None):
+        self.conversacion_id = conversacion_id
+        directorio = directorio or _directorio()
+        self.ruta_segmentos = os.path.join(directorio, f"{conversacion_id}.seg")
+        self.ruta_indice = os.path.join(directorio, f"{conversacion_id}.idx")
+
+    def _indice(self):
+        try:
+            with open(self.ruta_indice, "rb") as archivo:
+                datos = archivo.read()
+        except FileNotFoundError:
+            return []
+        completos = len(datos) - len(datos) % REGISTRO.size
+        return list(REGISTRO.iter_unpack(datos[:completos]))
+
+    def ultimo_id(self):
+        indice = self._indice()
+        return indice[-1][1] if indice else 0
+
+    def agregar(self, mensajes):
+        """Agrega mensajes (en orden de id y posteriores a `ultimo_id`) y sincroniza a disco."""
+        if not mensajes:
+            return
+        os.makedirs(os.path.dirname(self.ruta_indice), exist_ok=True)
+        with open(self.ruta_segmentos, "ab") as segmentos, open(self.ruta_indice, "ab") as indice:
+            fcntl.flock(indice, fcntl.LOCK_EX)
+            registros = []
+            for inicio in range(0, len(mensajes), MENSAJES_POR_BLOQUE):
+                bloque = mensajes[inicio: inicio + MENSAJES_POR_BLOQUE]
+                comprimido = zlib.compress(json.dumps([
+                    [m.id, m.remitente_id, m.contenido, m.leido, m.enviado_en.isoformat()] for m in bloque
+                ]).encode(), 6)
+                offset = segmentos.seek(0, os.SEEK_END)
+                segmentos.write(comprimido)
+                registros.append(REGISTRO.pack(bloque[0].id, bloque[-1].id, offset, len(comprimido), len(bloque)))
+            segmentos.flush()
+            os.fsync(segmentos.fileno())
+            indice.write(b"".join(registros))
+            indice.flush()
+            os.fsync(indice.fileno())
+
+    @contextmanager
+    def _segmentos(self):
+        with open(self.ruta_segmentos, "rb") as archivo:
+            with mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as datos:
+                yield datos
+
+    def _bloque(self, datos, entrada):
+        _, _, offset, longitud, _ = entrada
+        return [self._mensaje(fila) for fila in json.loads(zlib.decompress(datos[offset: offset + longitud]))]
+
+    def _mensaje(self, fila):
+        mensaje_id, remitente_id, contenido, leido, enviado_en = fila
+        return mensaje(
+            id=mensaje_id,
+            conversacion_id=self.conversacion_id,
+            remitente_id=remitente_id,
+            contenido=contenido,
+            leido=leido,
+            enviado_en=parse_datetime(enviado_en),
+        )
+
+    def anteriores(self, antes_id=None, limite=50, desde=None):
+        """Hasta `limite` mensajes con id < `antes_id`, en orden cronológico."""
+        indice = self._indice()
+        if antes_id is not None:
+            indice = indice[: bisect.bisect_left(indice, antes_id, key=lambda entrada: entrada[0])]
+        if not indice or not limite:
+            return []
+        encontrados = []
+        with self._segmentos() as datos:
+            for entrada in reversed(indice):
+                encontrados[:0] = [
+                    m for m in self._bloque(datos, entrada)
+                    if (antes_id is None or m.id < antes_id) and (desde is None or m.enviado_en > desde)
+                ]
+                if len(encontrados) >= limite:
+                    break
+        return encontrados[-limite:]
+
+    def posteriores(self, despues_id=0, limite=None, desde=None):
+        """Mensajes con id > `despues_id` en orden cronológico (todos si no hay `limite`)."""
+        indice = self._indice()
+        indice = indice[bisect.bisect_right(indice, despues_id, key=lambda entrada: entrada[1]):]
+        if not indice:
+            return []
+        encontrados = []
+        with self._segmentos() as datos:
+            for entrada in indice:
+                for m in self._bloque(datos, entrada):
+                    if m.id > despues_id and (desde is None or m.enviado_en > desde):
+                        encontrados.append(m)
+                        if limite is not None and len(encontrados) >= limite:
+                            return encontrados
+        return encontrados
+
+
+def archivar_conversacion(conversacion_id, antes_de, tamano_lote=5000):
+    """Mueve al archivo los mensajes enviados antes de `antes_de`, salvo el último de la conversación.
+
+    Devuelve cuántos mensajes salieron de la tabla.
+    """
+    archivo = ArchivoConversacion(conversacion_id)
+    mensajes = mensaje.objects.filter(conversacion_id=conversacion_id)
+
+    # Restos de una corrida anterior que alcanzó a archivar pero no a borrar.
+    movidos, _ = mensajes.filter(id__lte=archivo.ultimo_id()).delete()
+
+    ultimo = mensajes.order_by("-id").values_list("id", flat=True).first()
+    tope = (
+        mensajes.filter(enviado_en__lt=antes_de, id__lt=ultimo or 0)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if tope is None:
+        return movidos
+
+    while True:
+        lote = list(mensajes.filter(id__gt=archivo.ultimo_id(), id__lte=tope).order_by("id")[:tamano_lote])
+        if not lote:
+            return movidos
+        archivo.agregar(lote)
+        borrados, _ = mensajes.filter(id__gte=lote[0].id, id__lte=lote[-1].id).delete()
+        movidos += borrados
@@ -0,0 +1,263 @@
+"""Reparto de los mensajes del chat entre procesos.
+
+`enviar` publica en el broker y el broker entrega a `chat.hub` de cada proceso
+que tenga streams abiertos, sin pasar por la base de datos. Se elige con
+`CHAT_BROKER`:
+
+- `chat.broker.BrokerMemoria`: un solo proceso (por defecto).
+- `chat.broker.BrokerUnix`: varios workers en la misma máquina; cada proceso que
+  escucha crea un socket Unix de datagramas en `CHAT_BROKER_DIR`.
+- `chat.broker.BrokerRedis`: varios hosts, con Redis pub/sub en
+  `CHAT_BROKER_REDIS_URL` (requiere el paquete `redis`).
+
+Un paquete que solo trae `conversacion` llega a los streams como `DESBORDE` y los
+hace ponerse al día desde la base de datos. `BrokerUnix` lo usa cuando un mensaje
+no cabe en un datagrama y cuando tuvo que descartar paquetes porque la cola de
+otro proceso estaba llena: apenas esa cola vuelve a aceptar, le envía el aviso de
+cada conversación afectada.
+"""
+import atexit
+import errno
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .hub import DESBORDE, hub
+from .presencia import presencia
+
+logger = logging.getLogger(__name__)
+
+
+def _codificar(conversacion_id, datos):
+    return json.dumps({"conversacion": conversacion_id, "datos": datos}).encode()
+
+
+def _aviso(conversacion_id):
+    return json.dumps({"conversacion": conversacion_id}).encode()
+
+
+def _entregar(paquete):
+    try:
+        contenido = json.loads(paquete)
+        if "presencia" in contenido:
+            presencia.aplicar(contenido["presencia"])
+            return
+        conversacion_id = contenido["conversacion"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Paquete de chat inválido descartado.")
+        return
+    hub.publicar(conversacion_id, contenido.get("datos", DESBORDE))
+
+
+class Broker:
+    def publicar(self, conversacion_id, datos):
+        raise NotImplementedError
+
+    def publicar_presencia(self, anuncio):
+        """Lleva un anuncio de `chat.presencia` a los demás procesos."""
+
+    def escuchar(self):
+        """Empieza a recibir en este proceso; se llama antes de abrir un stream."""
+
+
+class BrokerMemoria(Broker):
+    def publicar(self, conversacion_id, datos):
+        hub.publicar(conversacion_id, datos)
+
+
+class BrokerUnix(Broker):
+    intervalo_reintento = 0.05
+
+    def __init__(self, directorio=None):
+        self.directorio = directorio or getattr(settings, "CHAT_BROKER_DIR", "/tmp/skillswap-chat")
+        self._lock = threading.Lock()
+        self._receptor = None
+        self._emisor = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Por ruta, conversaciones con paquetes descartados a las que les falta el aviso.
+        self._atrasados = {}
+        self._hay_atrasados = threading.Condition()
+        self._reintentos = None
+
+    def _ruta_propia(self):
+        return os.path.join(self.directorio, f"chat-{os.getpid()}.sock")
+
+    def escuchar(self):
+        with self._lock:
+            if self._receptor is not None:
+                return
+            os.makedirs(self.directorio, exist_ok=True)
+            ruta = self._ruta_propia()
+            if os.path.exists(ruta):
+                # Socket de un proceso anterior con el mismo pid.
+                os.unlink(ruta)
+            receptor = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receptor.bind(ruta)
+            atexit.register(self._cerrar, ruta)
+            self._receptor = receptor
+            threading.Thread(target=self._recibir, name="chat-broker-unix", daemon=True).start()
+
+    def _recibir(self):
+        receptor = self._receptor
+        while True:
+            try:
+                paquete = receptor.recv(1 << 20)
+            except OSError:
+                logger.exception("Se cerró el socket del broker; se reabrirá con el próximo stream.")
+                with self._lock:
+                    self._receptor = None
+                receptor.close()
+                self._cerrar(self._ruta_propia())
+                return
+            try:
+                _entregar(paquete)
+            except Exception:
+                # Un paquete problemático no debe dejar al proceso sin recibir.
+                logger.exception("Error al entregar un paquete del broker.")
+
+    def _cerrar(self, ruta):
+        try:
+            os.unlink(ruta)
+        except FileNotFoundError:
+            pass
+
+    def publicar(self, conversacion_id, datos):
+        self._difundir(_codificar(conversacion_id, datos), conversacion_id)
+
+    def publicar_presencia(self, anuncio):
+        # Si se descarta no hace falta avisar: el próximo latido lo reemplaza.
+        self._difundir(json.dumps({"presencia": anuncio}).encode())
+
+    def _difundir(self, paquete, conversacion_id=None):
+        for ruta in glob.glob(os.path.join(self.directorio, "chat-*.sock")):
+            try:
+                if not (self._ponerse_al_dia(ruta) and self._enviar(paquete, ruta, conversacion_id)):
+                    if conversacion_id is not None:
+                        self._atrasar(ruta, conversacion_id)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nadie escucha ahí: el proceso terminó sin limpiar.
+                self._olvidar(ruta)
+            except OSError:
+                logger.exception("No se pudo publicar en %s", ruta)
+
+    def _enviar(self, paquete, ruta, conversacion_id):
+        try:
+            return self._sin_bloquear(paquete, ruta)
+        except OSError as error:
+            if error.errno not in (errno.EMSGSIZE, errno.ENOBUFS) or conversacion_id is None:
+                raise
+            return self._sin_bloquear(_aviso(conversacion_id), ruta)
+
+    def _sin_bloquear(self, paquete, ruta):
+        """Envía sin esperar; False si la cola de `ruta` está llena.
+
+        Corre en el on_commit de la petición: un worker lento no debe frenar a
+        quien envía.
+        """
+        try:
+            self._emisor.sendto(paquete, socket.MSG_DONTWAIT, ruta)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _atrasar(self, ruta, conversacion_id):
+        with self._hay_atrasados:
+            if not self._atrasados.get(ruta):
+                logger.warning("Cola llena en %s; se avisará a sus streams que se pongan al día.", ruta)
+            self._atrasados.setdefault(ruta, set()).add(conversacion_id)
+            if self._reintentos is None:
+                self._reintentos = threading.Thread(target=self._reintentar, name="chat-broker-avisos", daemon=True)
+                self._reintentos.start()
+            self._hay_atrasados.notify()
+
+    def _ponerse_al_dia(self, ruta):
+        """Envía los avisos pendientes de `ruta`; False si la cola sigue llena."""
+        with self._hay_atrasados:
+            pendientes = self._atrasados.get(ruta)
+            while pendientes:
+                conversacion_id = next(iter(pendientes))
+                if not self._sin_bloquear(_aviso(conversacion_id), ruta):
+                    return False
+                pendientes.discard(conversacion_id)
+            self._atrasados.pop(ruta, None)
+        return True
+
+    def _olvidar(self, ruta):
+        with self._hay_atrasados:
+            self._atrasados.pop(ruta, None)
+        self._cerrar(ruta)
+
+    def _reintentar(self):
+        # Sin más publicaciones nadie volvería a intentar los avisos pendientes.
+        while True:
+            with self._hay_atrasados:
+                while not self._atrasados:
+                    self._hay_atrasados.wait()
+                rutas = list(self._atrasados)
+            time.sleep(self.intervalo_reintento)
+            for ruta in rutas:
+                try:
+                    self._ponerse_al_dia(ruta)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    self._olvidar(ruta)
+                except OSError:
+                    logger.exception("No se pudo avisar a %s", ruta)
+                    with self._hay_atrasados:
+                        self._atrasados.pop(ruta, None)
+
+
+class BrokerRedis(Broker):
+    canal = "skillswap:chat"
+
+    def __init__(self, url=None):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("BrokerRedis requiere el paquete 'redis'.")
+        url = url or getattr(settings, "CHAT_BROKER_REDIS_URL", "redis://localhost:6379/0")
+        self._cliente = redis.Redis.from_url(url)
+        self._lock = threading.Lock()
+        self._escuchando = False
+
+    def escuchar(self):
+        with self._lock:
+            if self._escuchando:
+                return
+            pubsub = self._cliente.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.canal)
+            self._escuchando = True
+            threading.Thread(target=self._recibir, args=(pubsub,), name="chat-broker-redis", daemon=True).start()
+
+    def _recibir(self, pubsub):
+        try:
+            for evento in pubsub.listen():
+                _entregar(evento["data"])
+        except Exception:
+            logger.exception("Se perdió la suscripción a Redis; se reintentará con el próximo stream.")
+            with self._lock:
+                self._escuchando = False
+
+    def publicar(self, conversacion_id, datos):
+        self._cliente.publish(self.canal, _codificar(conversacion_id, datos))
+
+    def publicar_presencia(self, anuncio):
+        self._cliente.publish(self.canal, json.dumps({"presencia": anuncio}))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, "CHAT_BROKER", "chat.broker.BrokerMemoria"))()
+        return _broker
@@ -0,0 +1,167 @@
+"""Difusión en proceso de los mensajes nuevos hacia los streams SSE.
+
+`ConversacionViewSet.enviar` publica cada mensaje al confirmarse la transacción
+y cada stream abierto espera en su propia cola, así que un stream inactivo no
+consulta la base de datos. Las colas viven en el event loop del stream y se
+alimentan con `call_soon_threadsafe`, porque `enviar` corre en otro hilo.
+
+Además de mensajes se publican avisos con clave `evento` (por ejemplo lecturas).
+Si una cola se llena, el stream recibe `DESBORDE` y debe ponerse al día desde la
+base de datos. El hub solo llega a los streams del mismo proceso.
+
+Además guarda los últimos mensajes de cada conversación para que un cliente que
+se reconecta con `Last-Event-ID` se ponga al día sin consultar la base de datos,
+siempre que no le falte nada anterior a lo que el hub conserva.
+
+Con varios workers el orden de confirmación no es el de los ids: un mensaje
+puede llegar después de otro de id mayor. Por eso los streams no descartan lo
+que queda por debajo del último id, sino que recuerdan qué entregaron
+(`Entregados`) y se ponen al día desde el primer hueco.
+"""
+import asyncio
+import threading
+from bisect import insort
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DESBORDE = object()
+
+
+class Suscripcion:
+    def __init__(self, loop, maximo):
+        self.loop = loop
+        self.cola = asyncio.Queue(maxsize=maximo)
+        self.desbordada = False
+
+    def _entregar(self, datos):
+        # Corre dentro del loop de la suscripción.
+        if self.desbordada:
+            return
+        try:
+            self.cola.put_nowait(datos)
+        except asyncio.QueueFull:
+            self.desbordada = True
+
+    async def siguiente(self):
+        if self.desbordada and self.cola.empty():
+            self.desbordada = False
+            return DESBORDE
+        return await self.cola.get()
+
+
+class Historial:
+    """Últimos mensajes de una conversación; están todos los de id mayor a `piso`."""
+
+    def __init__(self, piso, maximo):
+        self.piso = piso
+        self.maximo = maximo
+        self.eventos = []
+
+    def agregar(self, datos):
+        if datos["id"] <= self.piso:
+            # Llegó tarde y ya no cabe; `desde` manda a la base a quien lo necesite.
+            return
+        insort(self.eventos, (datos["id"], datos), key=lambda evento: evento[0])
+        if len(self.eventos) > self.maximo:
+            self.piso = self.eventos[-self.maximo - 1][0]
+            del self.eventos[:-self.maximo]
+
+    def desde(self, ultimo_id):
+        if ultimo_id < self.piso:
+            return None
+        return [datos for mensaje_id, datos in self.eventos if mensaje_id > ultimo_id]
+
+
+class Entregados:
+    """Ids ya entregados a un stream: todos los menores o iguales a `piso` y los de `ids`.
+
+    Ponerse al día desde `piso` cubre cualquier mensaje que se haya confirmado
+    tarde. Los ids son de todas las conversaciones, así que casi siempre hay
+    huecos que nunca se llenan; pasados `maximo` ids el piso avanza igual.
+    """
+
+    def __init__(self, piso, maximo=200):
+        self.piso = piso
+        self.maximo = maximo
+        self.ids = set()
+
+    def nuevo(self, mensaje_id):
+        """True si el mensaje no se había entregado; desde ahora cuenta como entregado."""
+        if mensaje_id <= self.piso or mensaje_id in self.ids:
+            return False
+        self.ids.add(mensaje_id)
+        if len(self.ids) > self.maximo:
+            self.piso = min(self.ids)
+            self.ids.remove(self.piso)
+        return True
+
+
+class Hub:
+    def __init__(self, maximo_cola=100, historial=50, max_conversaciones=1000):
+        self.maximo_cola = maximo_cola
+        self.historial = historial
+        self.max_conversaciones = max_conversaciones
+        self._lock = threading.Lock()
+        self._suscripciones = {}
+        self._historiales = OrderedDict()
+
+    @contextmanager
+    def suscribir(self, conversacion_id):
+        suscripcion = Suscripcion(asyncio.get_running_loop(), self.maximo_cola)
+        with self._lock:
+            self._suscripciones.setdefault(conversacion_id, set()).add(suscripcion)
+        try:
+            yield suscripcion
+        finally:
+            with self._lock:
+                suscripciones = self._suscripciones.get(conversacion_id)
+                if suscripciones is not None:
+                    suscripciones.discard(suscripcion)
+                    if not suscripciones:
+                        del self._suscripciones[conversacion_id]
+
+    def _registrar(self, conversacion_id, datos):
+        if datos is DESBORDE:
+            # No sabemos qué mensaje fue: el historial ya no está completo.
+            self._historiales.pop(conversacion_id, None)
+            return
+        if "evento" in datos:
+            # Avisos (lecturas, etc.): se entregan en vivo pero no se reproducen.
+            return
+        historial = self._historiales.get(conversacion_id)
+        if historial is None:
+            historial = self._historiales[conversacion_id] = Historial(datos["id"] - 1, self.historial)
+            if len(self._historiales) > self.max_conversaciones:
+                self._historiales.popitem(last=False)
+        else:
+            self._historiales.move_to_end(conversacion_id)
+        historial.agregar(datos)
+
+    def reproducir(self, conversacion_id, ultimo_id):
+        """Mensajes posteriores a `ultimo_id`, o None si hay que ir a la base de datos."""
+        with self._lock:
+            historial = self._historiales.get(conversacion_id)
+            if historial is None:
+                return None
+            return historial.desde(ultimo_id)
+
+    def publicar(self, conversacion_id, datos):
+        with self._lock:
+            if self.historial:
+                self._registrar(conversacion_id, datos)
+            suscripciones = list(self._suscripciones.get(conversacion_id, ()))
+        for suscripcion in suscripciones:
+            try:
+                suscripcion.loop.call_soon_threadsafe(suscripcion._entregar, datos)
+            except RuntimeError:
+                # El loop ya se cerró; la suscripción se limpiará al salir del stream.
+                pass
+
+
+hub = Hub(
+    maximo_cola=getattr(settings, "CHAT_HUB_MAX_COLA", 100),
+    historial=getattr(settings, "CHAT_HUB_HISTORIAL", 50),
+    max_conversaciones=getattr(settings, "CHAT_HUB_MAX_CONVERSACIONES", 1000),
+)
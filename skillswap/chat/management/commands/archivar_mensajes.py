@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archivo import archivar_conversacion
+from chat.models import mensaje
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve los mensajes más antiguos que --dias a los segmentos comprimidos de "
+        "CHAT_ARCHIVO_DIR. El último mensaje de cada conversación siempre queda en la tabla."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dias", type=int, default=getattr(settings, "CHAT_ARCHIVO_DIAS", 180))
+        parser.add_argument("--lote", type=int, default=5000, help="Mensajes archivados por bloque de escritura.")
+
+    def handle(self, *args, **options):
+        antes_de = timezone.now() - timedelta(days=options["dias"])
+        conversaciones = (
+            mensaje.objects.filter(enviado_en__lt=antes_de)
+            .order_by("conversacion_id")
+            .values_list("conversacion_id", flat=True)
+            .distinct()
+        )
+        total = 0
+        for conversacion_id in conversaciones.iterator():
+            total += archivar_conversacion(conversacion_id, antes_de, tamano_lote=options["lote"])
+        self.stdout.write(self.style.SUCCESS(f"Mensajes archivados: {total}."))
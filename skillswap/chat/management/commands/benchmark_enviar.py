@@ -0,0 +1,68 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from chat.models import conversacion, mensaje
+from chat.servicios import enviar_mensaje
+from usuarios.models import Usuario
+
+
+def enviar_original(usuario, conversacion_id, contenido):
+    """Camino original de `ConversacionViewSet.enviar` (get_object y comprobaciones sueltas)."""
+    conv = conversacion.objects.filter(participantes=usuario).prefetch_related("participantes").get(pk=conversacion_id)
+    if not conv.participantes.filter(pk=usuario.pk).exists():
+        raise PermissionError
+    otros = conv.participantes.exclude(pk=usuario.pk)
+    if otros.exclude(pk__in=usuario.matches.values_list("pk", flat=True)).exists():
+        raise PermissionError
+    mensaje.objects.create(conversacion=conv, remitente=usuario, contenido=contenido)
+    conv.fecha_actualizacion = timezone.now()
+    conv.save(update_fields=["fecha_actualizacion"])
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide consultas y latencia del envío de mensajes, original contra `chat.servicios`, "
+        "sobre datos sintéticos. Todo se genera dentro de una transacción que se revierte al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mensajes", type=int, default=500)
+        parser.add_argument("--participantes", type=int, default=2)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._medir(options)
+            transaction.set_rollback(True)
+
+    def _medir(self, options):
+        usuarios = Usuario.objects.bulk_create(
+            Usuario(email=f"bench-chat-{i}@bench.invalid", nombre="Bench", apellido="Bench", password="!")
+            for i in range(max(options["participantes"], 2))
+        )
+        remitente = usuarios[0]
+        remitente.matches.add(*usuarios[1:])
+        conv = conversacion.objects.create()
+        conv.participantes.add(*usuarios)
+
+        for nombre, enviar in (("original", enviar_original), ("servicio", enviar_mensaje)):
+            tiempos = []
+            with CaptureQueriesContext(connection) as consultas:
+                enviar(remitente, conv.pk, "calentamiento")
+            for i in range(options["mensajes"]):
+                inicio = time.perf_counter()
+                enviar(remitente, conv.pk, f"mensaje {i}")
+                tiempos.append(time.perf_counter() - inicio)
+            sentencias = [
+                consulta["sql"] for consulta in consultas.captured_queries
+                if not consulta["sql"].startswith(("SAVEPOINT", "RELEASE SAVEPOINT"))
+            ]
+            self.stdout.write(
+                f"  {nombre}: {len(sentencias)} consultas por mensaje, "
+                f"media {statistics.mean(tiempos) * 1000:.2f} ms, "
+                f"p50 {statistics.median(tiempos) * 1000:.2f} ms, máx {max(tiempos) * 1000:.2f} ms"
+            )
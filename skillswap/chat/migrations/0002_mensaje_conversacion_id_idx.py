@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['conversacion', 'id'], name='mensaje_conversacion_id_idx'),
+        ),
+    ]
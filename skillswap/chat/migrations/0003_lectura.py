@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def poblar_lecturas(apps, schema_editor):
+    conversacion = apps.get_model('chat', 'conversacion')
+    mensaje = apps.get_model('chat', 'mensaje')
+    lectura = apps.get_model('chat', 'lectura')
+    Participante = conversacion.participantes.through
+
+    participantes = {}
+    for conversacion_id, usuario_id in Participante.objects.values_list('conversacion_id', 'usuario_id'):
+        participantes.setdefault(conversacion_id, set()).add(usuario_id)
+
+    # El cursor de cada participante arranca en el último mensaje ajeno marcado como leído.
+    mensajes = {}
+    for conversacion_id, mensaje_id, remitente_id, leido in mensaje.objects.order_by('id').values_list(
+        'conversacion_id', 'id', 'remitente_id', 'leido'
+    ).iterator():
+        mensajes.setdefault(conversacion_id, []).append((mensaje_id, remitente_id, leido))
+
+    filas = []
+    for conversacion_id, usuarios in participantes.items():
+        de_la_conversacion = mensajes.get(conversacion_id, [])
+        for usuario_id in usuarios:
+            ajenos = [(mensaje_id, leido) for mensaje_id, remitente_id, leido in de_la_conversacion if remitente_id != usuario_id]
+            cursor = max((mensaje_id for mensaje_id, leido in ajenos if leido), default=0)
+            filas.append(lectura(
+                conversacion_id=conversacion_id,
+                usuario_id=usuario_id,
+                ultimo_leido_id=cursor,
+                no_leidos=sum(1 for mensaje_id, _ in ajenos if mensaje_id > cursor),
+            ))
+    lectura.objects.bulk_create(filas, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_mensaje_conversacion_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='lectura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultimo_leido_id', models.PositiveBigIntegerField(default=0)),
+                ('no_leidos', models.PositiveIntegerField(default=0)),
+                ('conversacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecturas', to='chat.conversacion')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecturas_chat', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('conversacion', 'usuario'), name='lectura_unica_por_participante')],
+            },
+        ),
+        migrations.RunPython(poblar_lecturas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:43
+
+from django.db import migrations, models
+
+
+def poblar_clave_par(apps, schema_editor):
+    conversacion = apps.get_model('chat', 'conversacion')
+    Participante = conversacion.participantes.through
+
+    participantes = {}
+    for conversacion_id, usuario_id in Participante.objects.values_list('conversacion_id', 'usuario_id'):
+        participantes.setdefault(conversacion_id, set()).add(usuario_id)
+
+    # Si una pareja ya tiene varias conversaciones, la clave queda en la más reciente;
+    # las demás siguen accesibles como conversaciones sin clave.
+    claves = {}
+    for conversacion_id in conversacion.objects.order_by('fecha_actualizacion', 'id').values_list('id', flat=True):
+        usuarios = participantes.get(conversacion_id, set())
+        if len(usuarios) == 2:
+            menor, mayor = sorted(usuarios)
+            claves[f"{menor}:{mayor}"] = conversacion_id
+
+    conversaciones = [conversacion(id=conversacion_id, clave_par=clave) for clave, conversacion_id in claves.items()]
+    conversacion.objects.bulk_update(conversaciones, ['clave_par'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_lectura'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversacion',
+            name='clave_par',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(poblar_clave_par, migrations.RunPython.noop),
+    ]
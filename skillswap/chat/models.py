@@ -1,10 +1,18 @@
 from django.db import models
 
+def clave_par(usuario_a_id, usuario_b_id):
+    """Clave canónica de la conversación 1:1 entre dos usuarios, sin importar el orden."""
+    menor, mayor = sorted((int(usuario_a_id), int(usuario_b_id)))
+    return f"{menor}:{mayor}"
+
+
 # Create your models here.
 class conversacion(models.Model):
     participantes = models.ManyToManyField('usuarios.Usuario', related_name='conversaciones')
     fecha_actualizacion = models.DateTimeField(auto_now=True)
     creado_en = models.DateTimeField(auto_now_add=True)
+    # Solo en conversaciones de dos personas (ver clave_par); las grupales quedan en NULL.
+    clave_par = models.CharField(max_length=41, null=True, blank=True, unique=True, editable=False)
 
     def __str__(self):
         return f"Conversación {self.id} - Participantes: {', '.join([str(p) for p in self.participantes.all()])}"
@@ -16,5 +24,26 @@ class mensaje(models.Model):
     leido = models.BooleanField(default=False)
     enviado_en = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Historial paginado por id y puesta al día de los streams.
+            models.Index(fields=["conversacion", "id"], name="mensaje_conversacion_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"Mensaje {self.id} de {self.remitente} en Conversación {self.conversacion.id}"
+
+class lectura(models.Model):
+    """Hasta dónde leyó cada participante una conversación y cuántos mensajes le faltan."""
+    conversacion = models.ForeignKey(conversacion, related_name='lecturas', on_delete=models.CASCADE)
+    usuario = models.ForeignKey('usuarios.Usuario', related_name='lecturas_chat', on_delete=models.CASCADE)
+    ultimo_leido_id = models.PositiveBigIntegerField(default=0)
+    no_leidos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversacion', 'usuario'], name='lectura_unica_por_participante'),
+        ]
+
     def __str__(self):
-        return f"Mensaje {self.id} de {self.remitente} en Conversación {self.conversacion.id}"
\ No newline at end of file
+        return f"Lectura de {self.usuario} en Conversación {self.conversacion_id} hasta {self.ultimo_leido_id}"
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MensajeCursorPagination(BasePagination):
+    """Historial por id en ambos sentidos: `?before=<id>`, `?after=<id>` y `limit`.
+
+    Sin `after` devuelve la página más reciente (anterior a `before` si viene), y
+    con `after` la siguiente hacia adelante. Cada página sale en orden
+    cronológico y se lee con el índice (conversacion, id). Igual que
+    `usuarios.pagination.KeysetPagination`, solo pagina si el cliente lo pide,
+    salvo que haya mensajes archivados: ahí entrega la página más reciente, para
+    no descomprimir el archivo completo en cada petición.
+
+    Si la vista asigna `archivo` (ver `chat.archivo`), las páginas siguen hacia
+    los mensajes archivados cuando la tabla no alcanza; `desde` aplica ahí el
+    mismo filtro de fecha que ya tenga el queryset.
+    """
+
+    archivo = None
+    desde = None
+
+    before_query_param = "before"
+    after_query_param = "after"
+    page_size_query_param = "limit"
+    page_size = 50
+    max_page_size = 200
+    invalid_cursor_message = _("Cursor inválido.")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        pedida = any(p in params for p in (self.before_query_param, self.after_query_param, self.page_size_query_param))
+        if not pedida and (self.archivo is None or not self.archivo.ultimo_id()):
+            return None
+
+        self.request = request
+        limite = self.get_page_size(request)
+        antes = self._cursor(params, self.before_query_param)
+        despues = self._cursor(params, self.after_query_param)
+
+        if despues is not None:
+            filas = []
+            if self.archivo is not None:
+                filas = [
+                    m for m in self.archivo.posteriores(despues, limite + 1, self.desde)
+                    if antes is None or m.id < antes
+                ]
+            queryset = queryset.filter(id__gt=despues)
+            if antes is not None:
+                queryset = queryset.filter(id__lt=antes)
+            if len(filas) <= limite:
+                filas += list(queryset.order_by("id")[: limite + 1 - len(filas)])
+            self.hay_siguientes = len(filas) > limite
+            filas = filas[:limite]
+            self.hay_anteriores = True
+        else:
+            if antes is not None:
+                queryset = queryset.filter(id__lt=antes)
+            filas = list(queryset.order_by("-id")[: limite + 1])[::-1]
+            if len(filas) <= limite and self.archivo is not None:
+                # Los archivados son todos anteriores a los que siguen en la tabla.
+                tope = filas[0].id if filas else antes
+                filas = self.archivo.anteriores(tope, limite + 1 - len(filas), self.desde) + filas
+            self.hay_anteriores = len(filas) > limite
+            filas = filas[-limite:]
+            self.hay_siguientes = antes is not None
+
+        self.filas = filas
+        return filas
+
+    def get_page_size(self, request):
+        try:
+            limite = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if limite <= 0:
+            return self.page_size
+        return min(limite, self.max_page_size)
+
+    def _cursor(self, params, nombre):
+        valor = params.get(nombre)
+        if valor in (None, ""):
+            return None
+        try:
+            return int(valor)
+        except ValueError:
+            raise ValidationError({nombre: self.invalid_cursor_message})
+
+    def _enlace(self, param, valor):
+        url = self.request.build_absolute_uri()
+        for otro in (self.before_query_param, self.after_query_param):
+            url = remove_query_param(url, otro)
+        return replace_query_param(url, param, valor)
+
+    def get_previous_link(self):
+        if not self.filas or not self.hay_anteriores:
+            return None
+        return self._enlace(self.before_query_param, self.filas[0].id)
+
+    def get_next_link(self):
+        if not self.filas or not self.hay_siguientes:
+            return None
+        return self._enlace(self.after_query_param, self.filas[-1].id)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("previous", self.get_previous_link()),
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
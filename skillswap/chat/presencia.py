@@ -0,0 +1,155 @@
+"""Presencia en el chat (en línea y escribiendo), en memoria y con vencimiento.
+
+Los streams SSE y las conexiones WebSocket llaman a `latido` al abrirse y
+mientras siguen vivos; un usuario sin latidos durante `CHAT_PRESENCIA_TTL`
+segundos deja de estar en línea. "Escribiendo" vence a los
+`CHAT_ESCRIBIENDO_TTL` segundos si el cliente no lo renueva.
+
+Cada proceso lleva su registro, pero lo anuncia por el broker (ver
+`chat.broker`) para que `/presencia/` responda igual desde cualquier worker: el
+latido de un usuario a lo sumo cada tercio del TTL, y cada vez que empieza o
+deja de escribir. Con `BrokerMemoria` no hay a quién anunciar.
+
+Nada de esto escribe en la base en cada latido: la última actividad se guarda en
+`Usuario.ultima_actividad` con un solo `bulk_update`, a lo sumo cada
+`CHAT_PRESENCIA_VOLCADO` segundos y solo desde el proceso que recibió el latido.
+"""
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from usuarios.models import Usuario
+
+logger = logging.getLogger(__name__)
+
+
+class Presencia:
+    def __init__(self, ttl=45, ttl_escribiendo=6, intervalo_volcado=300):
+        self.ttl = ttl
+        self.ttl_escribiendo = ttl_escribiendo
+        self.intervalo_volcado = intervalo_volcado
+        self._lock = threading.Lock()
+        self._vistos = {}
+        self._escribiendo = {}
+        self._pendientes = {}
+        self._anunciados = {}
+        self._proximo_volcado = time.monotonic() + intervalo_volcado
+
+    def latido(self, usuario_id):
+        """Marca al usuario en línea.
+
+        Devuelve (volcar, anuncio): si ya corresponde llamar a `volcar`, y lo que
+        hay que pasarle a `anunciar` (None si los otros procesos ya lo saben).
+        """
+        ahora = time.monotonic()
+        fecha = timezone.now()
+        anuncio = None
+        with self._lock:
+            self._vistos[usuario_id] = (ahora + self.ttl, fecha)
+            self._pendientes[usuario_id] = fecha
+            if self._anunciados.get(usuario_id, 0) <= ahora:
+                self._anunciados[usuario_id] = ahora + self.ttl / 3
+                anuncio = {"usuario": usuario_id, "fecha": fecha.isoformat()}
+            if ahora < self._proximo_volcado:
+                return False, anuncio
+            # Solo un latido por intervalo dispara el volcado.
+            self._proximo_volcado = ahora + self.intervalo_volcado
+            return True, anuncio
+
+    async def alatido(self, usuario_id):
+        """`latido` para los streams: anuncia y vuelca fuera del event loop."""
+        volcar, anuncio = self.latido(usuario_id)
+        if anuncio is not None:
+            await sync_to_async(self.anunciar, thread_sensitive=False)(anuncio)
+        if volcar:
+            await sync_to_async(self.volcar)()
+
+    def escribiendo(self, conversacion_id, usuario_id):
+        """Marca que el usuario escribe; devuelve True si hay que avisar a los demás.
+
+        Solo se avisa al empezar y luego cada medio TTL, aunque el cliente lo
+        renueve más seguido.
+        """
+        _, anuncio = self.latido(usuario_id)
+        ahora = time.monotonic()
+        clave = (conversacion_id, usuario_id)
+        with self._lock:
+            anterior = self._escribiendo.get(clave)
+            avisar = anterior is None or anterior[0] <= ahora or anterior[1] <= ahora - self.ttl_escribiendo / 2
+            self._escribiendo[clave] = (ahora + self.ttl_escribiendo, ahora if avisar else anterior[1])
+        if avisar:
+            anuncio = {**(anuncio or {"usuario": usuario_id}), "escribiendo": conversacion_id}
+        if anuncio is not None:
+            self.anunciar(anuncio)
+        return avisar
+
+    def dejo_de_escribir(self, conversacion_id, usuario_id):
+        with self._lock:
+            escribia = self._escribiendo.pop((conversacion_id, usuario_id), None)
+        if escribia is not None:
+            self.anunciar({"usuario": usuario_id, "dejo_de_escribir": conversacion_id})
+
+    def anunciar(self, anuncio):
+        """Pasa `anuncio` a los demás procesos; si falla, solo se pierde hasta el próximo."""
+        from .broker import get_broker  # chat.broker importa este módulo
+
+        try:
+            get_broker().publicar_presencia(anuncio)
+        except Exception:
+            logger.exception("No se pudo anunciar la presencia del usuario %s.", anuncio["usuario"])
+
+    def aplicar(self, anuncio):
+        """Registra un anuncio de otro proceso (o el propio, que llega de vuelta)."""
+        ahora = time.monotonic()
+        usuario_id = anuncio["usuario"]
+        with self._lock:
+            if "fecha" in anuncio:
+                vence = max(ahora + self.ttl, self._vistos.get(usuario_id, (0, None))[0])
+                self._vistos[usuario_id] = (vence, parse_datetime(anuncio["fecha"]))
+            if "escribiendo" in anuncio:
+                self._escribiendo[(anuncio["escribiendo"], usuario_id)] = (ahora + self.ttl_escribiendo, ahora)
+            if "dejo_de_escribir" in anuncio:
+                self._escribiendo.pop((anuncio["dejo_de_escribir"], usuario_id), None)
+
+    def estado(self, conversacion_id, usuarios):
+        """Presencia de cada usuario; sin latidos, `ultima_actividad` es la guardada en la base."""
+        ahora = time.monotonic()
+        estados = []
+        with self._lock:
+            for usuario in usuarios:
+                vence, fecha = self._vistos.get(usuario.pk, (0, usuario.ultima_actividad))
+                escribiendo = self._escribiendo.get((conversacion_id, usuario.pk))
+                estados.append({
+                    "usuario": usuario.pk,
+                    "en_linea": vence > ahora,
+                    "escribiendo": escribiendo is not None and escribiendo[0] > ahora,
+                    "ultima_actividad": fecha,
+                })
+        return estados
+
+    def volcar(self):
+        """Guarda la última actividad pendiente y descarta las entradas vencidas."""
+        ahora = time.monotonic()
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            self._proximo_volcado = ahora + self.intervalo_volcado
+            self._vistos = {pk: valor for pk, valor in self._vistos.items() if valor[0] > ahora}
+            self._escribiendo = {clave: valor for clave, valor in self._escribiendo.items() if valor[0] > ahora}
+            self._anunciados = {pk: proximo for pk, proximo in self._anunciados.items() if proximo > ahora}
+        if pendientes:
+            Usuario.objects.bulk_update(
+                [Usuario(pk=pk, ultima_actividad=fecha) for pk, fecha in pendientes.items()], ["ultima_actividad"]
+            )
+        return len(pendientes)
+
+
+presencia = Presencia(
+    ttl=getattr(settings, "CHAT_PRESENCIA_TTL", 45),
+    ttl_escribiendo=getattr(settings, "CHAT_ESCRIBIENDO_TTL", 6),
+    intervalo_volcado=getattr(settings, "CHAT_PRESENCIA_VOLCADO", 300),
+)
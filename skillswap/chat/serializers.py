@@ -13,4 +13,15 @@ class MensajeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = mensaje
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+
+
+class BandejaSerializer(ConversacionSerializer):
+    """Conversación con su último mensaje y los no leídos del usuario (ver `ConversacionViewSet.bandeja`)."""
+
+    ultimo_mensaje = MensajeSerializer(read_only=True, allow_null=True)
+    ultimo_leido_id = serializers.IntegerField(read_only=True)
+    no_leidos = serializers.IntegerField(read_only=True)
+
+    class Meta(ConversacionSerializer.Meta):
+        fields = "__all__"
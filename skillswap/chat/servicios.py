@@ -0,0 +1,172 @@
+"""Operaciones del chat compartidas por la API REST, el stream SSE y el WebSocket."""
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied, ValidationError
+
+from usuarios.models import Usuario
+from .acceso import Match, conversaciones_con_acceso, conversaciones_habilitadas
+from .archivo import ArchivoConversacion
+from .broker import get_broker
+from .hub import hub
+from .models import clave_par, conversacion, lectura, mensaje
+from .presencia import presencia
+from .serializers import MensajeSerializer
+
+
+class ContenidoVacio(APIException):
+    status_code = 400
+    default_detail = "Contenido obligatorio."
+    default_code = "contenido_vacio"
+
+
+def _id_conversacion(conversacion_id):
+    try:
+        return int(conversacion_id)
+    except (TypeError, ValueError):
+        raise NotFound("Conversación no encontrada.")
+
+
+def _validar_acceso(usuario, conversacion_id):
+    conversacion_id = _id_conversacion(conversacion_id)
+    acceso = (
+        conversaciones_con_acceso(usuario)
+        .filter(pk=conversacion_id)
+        .values("es_participante", "sin_match")
+        .first()
+    )
+    # Igual que en la API: una conversación ajena no existe para el usuario.
+    if acceso is None or not acceso["es_participante"]:
+        raise NotFound("Conversación no encontrada.")
+    if acceso["sin_match"]:
+        raise PermissionDenied("Solo puedes chatear con usuarios con los que tienes match.")
+    return conversacion_id
+
+
+def enviar_mensaje(usuario, conversacion_id, contenido):
+    """Guarda el mensaje y lo publica al confirmar; devuelve su representación.
+
+    El UPDATE de `fecha_actualizacion` solo toca la conversación si el usuario
+    participa y tiene match con los demás, así que también es la autorización:
+    en el caso normal son un UPDATE y un INSERT (más el contador de no leídos).
+    """
+    if contenido is not None and not isinstance(contenido, str):
+        raise ValidationError({"contenido": "Debe ser texto."})
+    contenido = (contenido or "").strip()
+    if not contenido:
+        raise ContenidoVacio()
+    conversacion_id = _id_conversacion(conversacion_id)
+
+    with transaction.atomic():
+        habilitada = conversaciones_habilitadas(usuario).filter(pk=conversacion_id).update(
+            fecha_actualizacion=timezone.now()
+        )
+        if not habilitada:
+            # Solo para responder con el error adecuado.
+            _validar_acceso(usuario, conversacion_id)
+            raise NotFound("Conversación no encontrada.")
+
+        nuevo = mensaje.objects.create(
+            conversacion_id=conversacion_id, remitente=usuario, contenido=contenido
+        )
+        datos = MensajeSerializer(nuevo).data
+        transaction.on_commit(lambda: get_broker().publicar(conversacion_id, datos))
+    presencia.dejo_de_escribir(conversacion_id, usuario.pk)
+    return datos
+
+
+def avisar_escribiendo(usuario, conversacion_id):
+    """Registra que `usuario` escribe y, si corresponde, lo avisa a la conversación."""
+    conversacion_id = _validar_acceso(usuario, conversacion_id)
+    if presencia.escribiendo(conversacion_id, usuario.pk):
+        get_broker().publicar(conversacion_id, {
+            "evento": "escribiendo",
+            "conversacion": conversacion_id,
+            "usuario": usuario.pk,
+            "ttl": presencia.ttl_escribiendo,
+        })
+
+
+def obtener_o_crear_conversacion(usuario, participantes_ids):
+    """Crea la conversación o, si es 1:1 y ya existe, devuelve la existente.
+
+    Valida con una sola consulta que los participantes existan y que `usuario`
+    tenga match con todos. Devuelve (conversacion, creada).
+    """
+    try:
+        participantes_ids = {int(pk) for pk in participantes_ids}
+    except (TypeError, ValueError):
+        raise ValidationError({"participantes": "Uno o más participantes no existen."})
+    if not participantes_ids:
+        raise ValidationError({"participantes": "Debes incluir al menos un participante."})
+
+    encontrados = dict(
+        Usuario.objects.filter(pk__in=participantes_ids)
+        .annotate(tiene_match=Exists(Match.objects.filter(from_usuario_id=usuario.pk, to_usuario_id=OuterRef("pk"))))
+        .values_list("pk", "tiene_match")
+    )
+    if len(encontrados) != len(participantes_ids):
+        raise ValidationError({"participantes": "Uno o más participantes no existen."})
+    if not all(tiene_match for pk, tiene_match in encontrados.items() if pk != usuario.pk):
+        raise PermissionDenied("Solo puedes chatear con usuarios con los que tienes match.")
+
+    otros = participantes_ids - {usuario.pk}
+    clave = clave_par(usuario.pk, *otros) if len(otros) == 1 else None
+    if clave is not None:
+        existente = conversacion.objects.filter(clave_par=clave).first()
+        if existente is not None:
+            return existente, False
+
+    try:
+        with transaction.atomic():
+            nueva = conversacion.objects.create(clave_par=clave)
+            nueva.participantes.add(usuario, *otros)
+    except IntegrityError:
+        # Otra petición creó la misma conversación 1:1 entremedio.
+        return conversacion.objects.get(clave_par=clave), False
+    return nueva, True
+
+
+def marcar_leidos(usuario, conversacion_id, hasta_id):
+    """Avanza el cursor de lectura de `usuario` hasta el mensaje `hasta_id` con un solo UPDATE.
+
+    Los no leídos se recalculan con lo que queda después del cursor (casi
+    siempre nada). Devuelve si el cursor avanzó.
+    """
+    with transaction.atomic():
+        conversacion_id = _validar_acceso(usuario, conversacion_id)
+        ajenos = mensaje.objects.filter(conversacion_id=conversacion_id).exclude(remitente=usuario)
+        restantes = (
+            ajenos.filter(id__gt=hasta_id).values("conversacion").annotate(total=Count("id")).values("total")
+        )
+        avanzo = lectura.objects.filter(
+            Exists(mensaje.objects.filter(conversacion_id=conversacion_id, id=hasta_id)),
+            conversacion_id=conversacion_id,
+            usuario=usuario,
+            ultimo_leido_id__lt=hasta_id,
+        ).update(ultimo_leido_id=hasta_id, no_leidos=Coalesce(Subquery(restantes), 0))
+
+        if avanzo:
+            aviso = {"evento": "leido", "conversacion": conversacion_id, "usuario": usuario.pk, "hasta": hasta_id}
+            transaction.on_commit(lambda: get_broker().publicar(conversacion_id, aviso))
+    return bool(avanzo)
+
+
+async def amensajes_desde(conversacion_id, ultimo_id):
+    """Mensajes posteriores a `ultimo_id`: del historial del hub o, si no alcanza, de la base."""
+    recientes = hub.reproducir(conversacion_id, ultimo_id)
+    if recientes is not None:
+        return recientes
+    return await sync_to_async(
+        lambda: MensajeSerializer(mensajes_posteriores(conversacion_id, ultimo_id), many=True).data
+    )()
+
+
+def mensajes_posteriores(conversacion_id, ultimo_id):
+    """Mensajes con id > `ultimo_id`, del archivo en frío y de la tabla, en orden."""
+    archivados = ArchivoConversacion(conversacion_id).posteriores(ultimo_id)
+    return archivados + list(
+        mensaje.objects.filter(conversacion_id=conversacion_id, id__gt=ultimo_id).order_by("id")
+    )
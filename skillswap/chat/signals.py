@@ -0,0 +1,65 @@
+from django.db.models import Count, F
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+
+from .models import conversacion, lectura, mensaje
+
+
+@receiver(post_save, sender=mensaje)
+def contar_no_leido(sender, instance, created, **kwargs):
+    if not created:
+        return
+    lectura.objects.filter(conversacion_id=instance.conversacion_id).exclude(
+        usuario_id=instance.remitente_id
+    ).update(no_leidos=F("no_leidos") + 1)
+
+
+@receiver(m2m_changed, sender=conversacion.participantes.through)
+def sincronizar_lecturas(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in {"post_add", "post_remove", "post_clear"}:
+        return
+
+    if reverse:
+        lecturas = lectura.objects.filter(usuario=instance)
+        otro_lado = "conversacion_id__in"
+        pares = [(conversacion_id, instance.pk) for conversacion_id in pk_set or ()]
+    else:
+        lecturas = lectura.objects.filter(conversacion=instance)
+        otro_lado = "usuario_id__in"
+        pares = [(instance.pk, usuario_id) for usuario_id in pk_set or ()]
+
+    if action == "post_clear":
+        lecturas.delete()
+    elif action == "post_remove":
+        lecturas.filter(**{otro_lado: pk_set}).delete()
+    else:
+        _crear_lecturas(pares)
+
+
+def _crear_lecturas(pares):
+    # Quien se suma tiene pendiente todo lo que escribieron los demás.
+    conversacion_ids = {conversacion_id for conversacion_id, _ in pares}
+    totales = dict(
+        mensaje.objects.filter(conversacion_id__in=conversacion_ids)
+        .values_list("conversacion_id")
+        .annotate(total=Count("id"))
+    )
+    propios = {
+        (conversacion_id, remitente_id): total
+        for conversacion_id, remitente_id, total in mensaje.objects.filter(
+            conversacion_id__in=conversacion_ids, remitente_id__in={usuario_id for _, usuario_id in pares}
+        )
+        .values_list("conversacion_id", "remitente_id")
+        .annotate(total=Count("id"))
+    }
+    lectura.objects.bulk_create(
+        [
+            lectura(
+                conversacion_id=conversacion_id,
+                usuario_id=usuario_id,
+                no_leidos=totales.get(conversacion_id, 0) - propios.get((conversacion_id, usuario_id), 0),
+            )
+            for conversacion_id, usuario_id in pares
+        ],
+        ignore_conflicts=True,
+    )
@@ -1,3 +1,346 @@
-from django.test import TestCase
+import json
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from usuarios.models import Usuario
+
+from .archivo import REGISTRO, ArchivoConversacion, archivar_conversacion
+from .broker import BrokerUnix, _entregar
+from .hub import Entregados, Historial, Hub
+from .presencia import Presencia
+from .models import conversacion, lectura, mensaje
+from .servicios import marcar_leidos, mensajes_posteriores
+from .websocket import ConexionChat, chat_websocket
+
+
+def campos(mensajes):
+    return [(m.id, m.remitente_id, m.contenido, m.leido, m.enviado_en) for m in mensajes]
+
+
+class ArchivoConversacionTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ajustes = override_settings(CHAT_ARCHIVO_DIR=directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.ana = Usuario.objects.create_user(email="ana@example.com", nombre="Ana", apellido="a")
+        self.beto = Usuario.objects.create_user(email="beto@example.com", nombre="Beto", apellido="b")
+        self.conversacion = conversacion.objects.create()
+        self.conversacion.participantes.add(self.ana, self.beto)
+
+        self.viejo = timezone.now() - timedelta(days=400)
+        for i in range(300):
+            mensaje.objects.create(
+                conversacion=self.conversacion,
+                remitente=self.ana if i % 3 else self.beto,
+                contenido=f"mensaje {i} con tildes: ñandú",
+                leido=i % 2 == 0,
+            )
+        self.ids = list(self.conversacion.mensajes.order_by("id").values_list("id", flat=True))
+        # Los primeros 290 quedan en el pasado; el resto es reciente.
+        mensaje.objects.filter(id__in=self.ids[:290]).update(enviado_en=self.viejo)
+        self.originales = campos(self.conversacion.mensajes.order_by("id"))
+
+    def archivar(self, tamano_lote=100):
+        return archivar_conversacion(self.conversacion.pk, timezone.now() - timedelta(days=180), tamano_lote)
+
+    def test_archivo_y_tabla_reconstruyen_el_historial(self):
+        self.assertEqual(self.archivar(), 290)
+        archivo = ArchivoConversacion(self.conversacion.pk)
+        self.assertEqual(archivo.ultimo_id(), self.ids[289])
+        self.assertEqual(self.conversacion.mensajes.count(), 10)
+        self.assertEqual(campos(mensajes_posteriores(self.conversacion.pk, 0)), self.originales)
+
+    def test_lecturas_parciales_del_archivo(self):
+        self.archivar()
+        archivo = ArchivoConversacion(self.conversacion.pk)
+        self.assertEqual(campos(archivo.anteriores(self.ids[150], 20)), self.originales[130:150])
+        self.assertEqual(campos(archivo.posteriores(self.ids[150], 20)), self.originales[151:171])
+        self.assertEqual(campos(archivo.anteriores(None, 5)), self.originales[285:290])
+        self.assertEqual(archivo.posteriores(self.ids[289]), [])
+        self.assertEqual(archivo.posteriores(0, desde=self.viejo), [])
+
+    def test_el_ultimo_mensaje_no_se_archiva(self):
+        mensaje.objects.filter(conversacion=self.conversacion).update(enviado_en=self.viejo)
+        self.assertEqual(self.archivar(), 299)
+        self.assertEqual(list(self.conversacion.mensajes.values_list("id", flat=True)), [self.ids[-1]])
+
+    def test_se_recupera_de_una_corrida_interrumpida(self):
+        # Un bloque escrito sin su registro completo no existe para las lecturas.
+        self.archivar()
+        archivo = ArchivoConversacion(self.conversacion.pk)
+        with open(archivo.ruta_indice, "ab") as indice:
+            indice.write(REGISTRO.pack(self.ids[290], self.ids[299], 0, 1, 10)[:-3])
+        self.assertEqual(archivo.ultimo_id(), self.ids[289])
+
+        # Mensajes ya archivados que no alcanzaron a borrarse de la tabla.
+        mensaje.objects.bulk_create(
+            [
+                mensaje(id=m_id, conversacion=self.conversacion, remitente_id=remitente_id, contenido=contenido)
+                for m_id, remitente_id, contenido, _, _ in self.originales[280:290]
+            ]
+        )
+        self.assertEqual(self.archivar(), 10)
+        self.assertEqual(campos(mensajes_posteriores(self.conversacion.pk, 0)), self.originales)
+
+    def test_historial_paginado_atraviesa_el_archivo(self):
+        self.archivar()
+        self.client.force_login(self.ana)
+        url = f"/api/chat/conversaciones/{self.conversacion.pk}/mensajes/"
+
+        # Con mensajes archivados la respuesta por defecto ya viene paginada.
+        pagina = self.client.get(url).json()
+        self.assertEqual([m["id"] for m in pagina["results"]], self.ids[-50:])
+        self.assertIsNone(pagina["next"])
+
+        hacia_atras, siguiente = [], f"{url}?limit=37"
+        while siguiente:
+            pagina = self.client.get(siguiente).json()
+            hacia_atras[:0] = [m["id"] for m in pagina["results"]]
+            siguiente = pagina["previous"]
+        self.assertEqual(hacia_atras, self.ids)
+
+        hacia_adelante, siguiente = [], f"{url}?after=0&limit=37"
+        while siguiente:
+            pagina = self.client.get(siguiente).json()
+            hacia_adelante += [m["id"] for m in pagina["results"]]
+            siguiente = pagina["next"]
+        self.assertEqual(hacia_adelante, self.ids)
+
+
+class LecturasTests(TestCase):
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(email="ana@example.com", nombre="Ana", apellido="a")
+        self.beto = Usuario.objects.create_user(email="beto@example.com", nombre="Beto", apellido="b")
+        self.carla = Usuario.objects.create_user(email="carla@example.com", nombre="Carla", apellido="c")
+        self.ana.matches.add(self.beto, self.carla)
+        self.beto.matches.add(self.carla)
+        self.conversacion = conversacion.objects.create()
+        self.conversacion.participantes.add(self.ana, self.beto)
+        remitentes = [self.ana, self.beto, self.ana, self.ana, self.beto]
+        self.ids = [
+            mensaje.objects.create(conversacion=self.conversacion, remitente=remitente, contenido=f"m{i}").pk
+            for i, remitente in enumerate(remitentes)
+        ]
+
+    def lectura(self, usuario):
+        fila = lectura.objects.get(conversacion=self.conversacion, usuario=usuario)
+        return fila.ultimo_leido_id, fila.no_leidos
+
+    def test_cada_uno_cuenta_lo_que_escribieron_los_demas(self):
+        self.assertEqual(self.lectura(self.ana), (0, 2))
+        self.assertEqual(self.lectura(self.beto), (0, 3))
+
+    def test_quien_se_suma_tiene_pendiente_el_historial(self):
+        self.conversacion.participantes.add(self.carla)
+        self.assertEqual(self.lectura(self.carla), (0, 5))
+        # Al volver, lo propio no cuenta como pendiente.
+        self.conversacion.participantes.remove(self.beto)
+        self.assertFalse(lectura.objects.filter(conversacion=self.conversacion, usuario=self.beto).exists())
+        self.beto.conversaciones.add(self.conversacion)
+        self.assertEqual(self.lectura(self.beto), (0, 3))
+
+    def test_leer_solo_avanza_y_recalcula_lo_que_falta(self):
+        self.client.force_login(self.beto)
+        url = f"/api/chat/conversaciones/{self.conversacion.pk}/leer/"
+        self.assertEqual(self.client.post(url, {"hasta": self.ids[2]}).status_code, 204)
+        self.assertEqual(self.lectura(self.beto), (self.ids[2], 1))
+
+        self.assertFalse(marcar_leidos(self.beto, self.conversacion.pk, self.ids[0]))
+        self.assertFalse(marcar_leidos(self.beto, self.conversacion.pk, self.ids[2]))
+        self.assertEqual(self.lectura(self.beto), (self.ids[2], 1))
+
+        self.assertTrue(marcar_leidos(self.beto, self.conversacion.pk, self.ids[4]))
+        self.assertEqual(self.lectura(self.beto), (self.ids[4], 0))
+
+    def test_leer_con_un_mensaje_de_otra_conversacion_no_cambia_nada(self):
+        otra = conversacion.objects.create()
+        otra.participantes.add(self.beto, self.carla)
+        ajeno = mensaje.objects.create(conversacion=otra, remitente=self.carla, contenido="hola")
+        self.assertFalse(marcar_leidos(self.beto, self.conversacion.pk, ajeno.pk))
+        self.assertEqual(self.lectura(self.beto), (0, 3))
+        self.assertEqual(lectura.objects.get(conversacion=otra, usuario=self.beto).no_leidos, 1)
+
+
+class HubTests(SimpleTestCase):
+    def test_entregados_acepta_un_id_menor_confirmado_tarde(self):
+        entregados = Entregados(10, maximo=3)
+        self.assertTrue(entregados.nuevo(13))
+        self.assertTrue(entregados.nuevo(11))
+        self.assertFalse(entregados.nuevo(13))
+        self.assertFalse(entregados.nuevo(10))
+        # Pasado el máximo el piso avanza hasta el menor entregado, no hasta el último.
+        self.assertTrue(entregados.nuevo(15))
+        self.assertTrue(entregados.nuevo(16))
+        self.assertEqual(entregados.piso, 11)
+        self.assertTrue(entregados.nuevo(12))
+        self.assertFalse(entregados.nuevo(11))
+
+    def test_historial_no_responde_por_debajo_del_piso(self):
+        historial = Historial(0, 3)
+        for mensaje_id in (1, 3, 2, 4, 5):
+            historial.agregar({"id": mensaje_id})
+        self.assertEqual(historial.piso, 2)
+        self.assertIsNone(historial.desde(1))
+        self.assertEqual([datos["id"] for datos in historial.desde(2)], [3, 4, 5])
+        # Uno que llega tarde por debajo del piso no se guarda: quien lo necesite va a la base.
+        historial.agregar({"id": 2})
+        self.assertEqual([datos["id"] for datos in historial.desde(2)], [3, 4, 5])
+
+
+class BrokerUnixTests(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.broker = BrokerUnix(directorio.name)
+        # Un proceso que no lee: su cola de datagramas se llena enseguida.
+        self.receptor = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(self.receptor.close)
+        self.receptor.bind(os.path.join(directorio.name, "chat-1.sock"))
+
+    def recibir_todo(self):
+        paquetes = []
+        self.receptor.settimeout(0.5)
+        try:
+            while True:
+                paquetes.append(json.loads(self.receptor.recv(1 << 16)))
+        except socket.timeout:
+            return paquetes
+
+    def test_cola_llena_termina_en_aviso_de_desborde(self):
+        with self.assertLogs("chat.broker", "WARNING"):
+            for mensaje_id in range(1, 51):
+                self.broker.publicar(7, {"id": mensaje_id})
+        paquetes = self.recibir_todo()
+
+        con_datos = [paquete["datos"]["id"] for paquete in paquetes if "datos" in paquete]
+        self.assertLess(len(con_datos), 50)
+        self.assertIn({"conversacion": 7}, paquetes)
+        self.assertEqual(self.broker._atrasados, {})
+
+    def test_el_aviso_invalida_el_historial_del_hub(self):
+        hub = Hub(historial=10)
+        hub.publicar(7, {"id": 4})
+        hub.publicar(7, {"id": 6})
+        self.assertEqual(hub.reproducir(7, 4), [{"id": 6}])
+        with mock.patch("chat.broker.hub", hub):
+            _entregar(json.dumps({"conversacion": 7}).encode())
+        self.assertIsNone(hub.reproducir(7, 4))
+
+
+class ChatWebSocketTests(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(email="ana@example.com", nombre="Ana", apellido="a")
+        self.token = Token.objects.create(user=self.usuario)
+
+    async def conversar(self, *frames):
+        entrada = [{"type": "websocket.connect"}]
+        entrada += [{"type": "websocket.receive", "text": json.dumps(frame)} for frame in frames]
+        entrada.append({"type": "websocket.disconnect"})
+        enviados = []
+
+        async def receive():
+            return entrada.pop(0)
+
+        async def send(evento):
+            enviados.append(evento)
+
+        scope = {"type": "websocket", "query_string": f"token={self.token.key}".encode(), "headers": []}
+        await chat_websocket(scope, receive, send)
+        return [json.loads(evento["text"]) for evento in enviados if evento["type"] == "websocket.send"], enviados
+
+    async def test_contenido_que_no_es_texto_responde_error(self):
+        frames, _ = await self.conversar(
+            {"tipo": "enviar", "conversacion": 1, "contenido": 5, "ref": "a"},
+            {"tipo": "ping", "ref": "b"},
+        )
+        self.assertEqual(frames[0]["tipo"], "error")
+        self.assertEqual((frames[0]["status"], frames[0]["ref"]), (400, "a"))
+        self.assertEqual(frames[1], {"tipo": "pong", "ref": "b"})
+
+    async def test_un_error_inesperado_no_cierra_la_conexion(self):
+        async def romper(conexion, frame):
+            raise RuntimeError("falla de prueba")
+
+        with mock.patch.dict(ConexionChat.manejadores, {"enviar": romper}), self.assertLogs("chat.websocket"):
+            frames, _ = await self.conversar({"tipo": "enviar", "ref": "a"}, {"tipo": "ping", "ref": "b"})
+        self.assertEqual(frames, [
+            {"tipo": "error", "detail": "Error interno.", "status": 500, "ref": "a"},
+            {"tipo": "pong", "ref": "b"},
+        ])
+
+    def test_enviar_por_rest_valida_el_contenido(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(
+            "/api/chat/conversaciones/1/enviar/", {"contenido": 5}, content_type="application/json"
+        )
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn("contenido", respuesta.json())
+
+    async def test_usuario_inactivo_no_se_conecta(self):
+        self.usuario.is_active = False
+        await self.usuario.asave(update_fields=["is_active"])
+        frames, enviados = await self.conversar({"tipo": "ping"})
+        self.assertEqual(frames, [])
+        self.assertEqual(enviados, [{"type": "websocket.close", "code": 4401}])
+
+    def test_usuario_inactivo_no_abre_el_stream(self):
+        self.usuario.is_active = False
+        self.usuario.save(update_fields=["is_active"])
+        respuesta = self.client.get(
+            "/api/chat/conversaciones/1/stream/", HTTP_AUTHORIZATION=f"Token {self.token.key}"
+        )
+        self.assertEqual(respuesta.status_code, 403)
+
+
+class PresenciaEntreProcesosTests(SimpleTestCase):
+    """Dos registros que se anuncian entre sí, como dos workers con el broker."""
+
+    def setUp(self):
+        self.a, self.b = Presencia(), Presencia()
+        procesos = (self.a, self.b)
+
+        class Relevo:
+            def publicar_presencia(self, anuncio):
+                for proceso in procesos:
+                    proceso.aplicar(json.loads(json.dumps(anuncio)))
+
+        parche = mock.patch("chat.broker.get_broker", return_value=Relevo())
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.usuario = Usuario(pk=1)
+
+    def estado(self, proceso):
+        return proceso.estado(9, [self.usuario])[0]
+
+    def test_el_latido_llega_a_los_otros_procesos(self):
+        self.assertFalse(self.estado(self.b)["en_linea"])
+        _, anuncio = self.a.latido(1)
+        self.a.anunciar(anuncio)
+        self.assertTrue(self.estado(self.b)["en_linea"])
+        self.assertEqual(self.estado(self.b)["ultima_actividad"], self.a._vistos[1][1])
+
+    def test_el_latido_se_anuncia_a_lo_sumo_cada_tercio_del_ttl(self):
+        self.assertIsNotNone(self.a.latido(1)[1])
+        self.assertIsNone(self.a.latido(1)[1])
+
+    def test_escribiendo_llega_a_los_otros_procesos(self):
+        self.assertTrue(self.a.escribiendo(9, 1))
+        self.assertTrue(self.estado(self.b)["escribiendo"])
+        self.assertTrue(self.estado(self.b)["en_linea"])
+        self.a.dejo_de_escribir(9, 1)
+        self.assertFalse(self.estado(self.b)["escribiendo"])
+
+    def test_el_broker_entrega_el_anuncio_al_registro(self):
+        with mock.patch("chat.broker.presencia", self.b):
+            _entregar(json.dumps({"presencia": {"usuario": 1, "escribiendo": 9}}).encode())
+        self.assertTrue(self.estado(self.b)["escribiendo"])
@@ -2,22 +2,36 @@ import json
 import logging
 import asyncio
 
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.http import Http404, HttpResponseForbidden, StreamingHttpResponse
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from rest_framework.authtoken.models import Token
 from asgiref.sync import sync_to_async
 
-from usuarios.models import Usuario
-from .models import conversacion, mensaje
-from .serializers import ConversacionSerializer, MensajeSerializer
+from .acceso import aacceso_conversacion, ausuario_por_token
+from .archivo import ArchivoConversacion
+from .broker import get_broker
+from .hub import DESBORDE, Entregados, hub
+from .models import conversacion, lectura, mensaje
+from .pagination import MensajeCursorPagination
+from .presencia import presencia
+from .servicios import (
+    amensajes_desde,
+    avisar_escribiendo,
+    enviar_mensaje,
+    marcar_leidos,
+    obtener_o_crear_conversacion,
+)
+from .serializers import BandejaSerializer, ConversacionSerializer, MensajeSerializer
 
 logger = logging.getLogger(__name__)
 
@@ -38,37 +52,66 @@ class ConversacionViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action in {"mensajes", "enviar"}:
             return MensajeSerializer
+        if self.action == "bandeja":
+            return BandejaSerializer
         return super().get_serializer_class()
 
+    def create(self, request, *args, **kwargs):
+        respuesta = super().create(request, *args, **kwargs)
+        if not self.conversacion_creada:
+            # La conversación 1:1 ya existía: se devuelve la misma.
+            respuesta.status_code = status.HTTP_200_OK
+        return respuesta
+
     def perform_create(self, serializer):
         participantes_ids = self.request.data.get("participantes", [])
 
         if isinstance(participantes_ids, str):
             participantes_ids = [pk for pk in participantes_ids.split(",") if pk]
 
-        if not participantes_ids:
-            raise ValidationError({"participantes": "Debes incluir al menos un participante."})
-
-        participantes_qs = Usuario.objects.filter(pk__in=participantes_ids)
-        if participantes_qs.count() != len(participantes_ids):
-            raise ValidationError({"participantes": "Uno o más participantes no existen."})
-
-        usuario = self.request.user
-
-        for participante in participantes_qs:
-            if participante != usuario and not usuario.matches.filter(pk=participante.pk).exists():
-                raise PermissionDenied("Solo puedes chatear con usuarios con los que tienes match.")
+        serializer.instance, self.conversacion_creada = obtener_o_crear_conversacion(
+            self.request.user, participantes_ids
+        )
 
-        nueva = serializer.save()
-        nueva.participantes.add(usuario, *participantes_qs)
-        nueva.save(update_fields=["fecha_actualizacion"])
+    @action(detail=False, methods=["get"], url_path="bandeja")
+    def bandeja(self, request):
+        """Lista de conversaciones con vista previa y no leídos, en tres consultas."""
+        lectura_propia = lectura.objects.filter(conversacion=OuterRef("pk"), usuario=request.user)
+        conversaciones = list(
+            self.get_queryset().annotate(
+                ultimo_mensaje_id=Subquery(
+                    mensaje.objects.filter(conversacion=OuterRef("pk")).order_by("-id").values("id")[:1]
+                ),
+                ultimo_leido_id=Coalesce(Subquery(lectura_propia.values("ultimo_leido_id")[:1]), 0),
+                no_leidos=Coalesce(Subquery(lectura_propia.values("no_leidos")[:1]), 0),
+            )
+        )
 
-    @action(detail=True, methods=["get"], url_path="mensajes")
+        ultimos = mensaje.objects.in_bulk(
+            [conv.ultimo_mensaje_id for conv in conversaciones if conv.ultimo_mensaje_id]
+        )
+        for conv in conversaciones:
+            conv.ultimo_mensaje = ultimos.get(conv.ultimo_mensaje_id)
+
+        return Response(BandejaSerializer(conversaciones, many=True).data)
+
+    @action(detail=True, methods=["post"], url_path="leer")
+    def leer(self, request, pk=None):
+        """Marca como leída la conversación hasta el mensaje `hasta`."""
+        try:
+            hasta = int(request.data.get("hasta"))
+        except (TypeError, ValueError):
+            raise ValidationError({"hasta": "Debe ser el id de un mensaje."})
+        marcar_leidos(request.user, pk, hasta)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=["get"], url_path="mensajes", pagination_class=MensajeCursorPagination)
     def mensajes(self, request, pk=None):
         conv = self.get_object()
-        mensajes_qs = conv.mensajes.select_related("remitente").order_by("enviado_en", "id")
+        mensajes_qs = conv.mensajes.order_by("id")
 
         since = request.query_params.get("since")
+        parsed = None
         if since:
             parsed = parse_datetime(since)
             if parsed is None:
@@ -78,36 +121,31 @@ class ConversacionViewSet(viewsets.ModelViewSet):
                 parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
             mensajes_qs = mensajes_qs.filter(enviado_en__gt=parsed)
 
-        return Response(MensajeSerializer(mensajes_qs, many=True).data)
+        archivo = ArchivoConversacion(conv.pk)
+        self.paginator.archivo, self.paginator.desde = archivo, parsed
+        pagina = self.paginate_queryset(mensajes_qs)
+        if pagina is not None:
+            return self.get_paginated_response(MensajeSerializer(pagina, many=True).data)
+        historial = archivo.posteriores(0, desde=parsed) + list(mensajes_qs)
+        return Response(MensajeSerializer(historial, many=True).data)
 
     @action(detail=True, methods=["post"], url_path="enviar")
     def enviar(self, request, pk=None):
-        conv = self.get_object()
-        contenido = request.data.get("contenido", "").strip()
-
-        if not contenido:
-            return Response({"detail": "Contenido obligatorio."},
-                            status=status.HTTP_400_BAD_REQUEST)
-
-        if not conv.participantes.filter(pk=request.user.pk).exists():
-            return Response({"detail": "No participas en esta conversación."},
-                            status=status.HTTP_403_FORBIDDEN)
-
-        otros = conv.participantes.exclude(pk=request.user.pk)
-        sin_match = otros.exclude(pk__in=request.user.matches.values_list("pk", flat=True))
-
-        if sin_match.exists():
-            return Response({"detail": "Solo puedes chatear con usuarios con los que tienes match."},
-                            status=status.HTTP_403_FORBIDDEN)
+        datos = enviar_mensaje(request.user, pk, request.data.get("contenido", ""))
+        return Response(datos, status=status.HTTP_201_CREATED)
 
-        nuevo = mensaje.objects.create(
-            conversacion=conv, remitente=request.user, contenido=contenido
-        )
-
-        conv.fecha_actualizacion = timezone.now()
-        conv.save(update_fields=["fecha_actualizacion"])
+    @action(detail=True, methods=["get"], url_path="presencia")
+    def estado_presencia(self, request, pk=None):
+        """En línea / escribiendo de cada participante (ver `chat.presencia`)."""
+        conv = self.get_object()
+        # Un worker sin streams abiertos también debe recibir los anuncios de los demás.
+        get_broker().escuchar()
+        return Response(presencia.estado(conv.pk, conv.participantes.all()))
 
-        return Response(MensajeSerializer(nuevo).data, status=status.HTTP_201_CREATED)
+    @action(detail=True, methods=["post"], url_path="escribiendo")
+    def escribiendo(self, request, pk=None):
+        avisar_escribiendo(request.user, pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 async def mensajes_sse(request, pk):
@@ -123,56 +161,63 @@ async def mensajes_sse(request, pk):
 
     token_key = auth.split(" ", 1)[1]
 
-    try:
-        token = await sync_to_async(Token.objects.get)(key=token_key)
-    except Token.DoesNotExist:
+    user = await ausuario_por_token(token_key)
+    if user is None:
         return HttpResponseForbidden("Invalid token")
 
-    user = await sync_to_async(lambda: token.user)()
-
-
-    try:
-        conv = await sync_to_async(
-            conversacion.objects.prefetch_related("participantes").get
-        )(pk=pk)
-    except conversacion.DoesNotExist:
+    acceso = await aacceso_conversacion(user, pk)
+    if acceso is None:
         raise Http404("Conversación no encontrada")
-
-    is_participant = await sync_to_async(
-        conv.participantes.filter(pk=user.pk).exists
-    )()
-    if not is_participant:
+    if not acceso["es_participante"]:
         return HttpResponseForbidden("No participas en esta conversación.")
+    if acceso["sin_match"]:
+        return HttpResponseForbidden("Solo chateas con usuarios con match.")
 
-    otros = await sync_to_async(list)(conv.participantes.exclude(pk=user.pk))
-    for p in otros:
-        has_match = await sync_to_async(
-            user.matches.filter(pk=p.pk).exists
-        )()
-        if not has_match:
-            return HttpResponseForbidden("Solo chateas con usuarios con match.")
-
+    # Los clientes SSE reenvían el último `id:` recibido en Last-Event-ID al reconectar.
     try:
-        last_id = int(request.GET.get("last_id", 0))
-    except:
+        last_id = int(request.headers.get("Last-Event-ID") or request.GET.get("last_id", 0))
+    except ValueError:
         last_id = 0
 
-    async def stream():
-        nonlocal last_id
-        yield b": stream-start\n\n"
-
-        while True:
-            nuevos = await sync_to_async(list)(
-                mensaje.objects.filter(conversacion_id=pk, id__gt=last_id).order_by("id")
-            )
+    keepalive = getattr(settings, "CHAT_SSE_KEEPALIVE", 15)
 
-            for msg in nuevos:
-                last_id = msg.id
-                data = MensajeSerializer(msg).data
-                yield f"data: {json.dumps(data)}\n\n".encode()
+    def evento(data):
+        if "evento" in data:
+            return f"event: {data['evento']}\ndata: {json.dumps(data)}\n\n".encode()
+        return f"id: {data['id']}\ndata: {json.dumps(data)}\n\n".encode()
 
-            yield b"event: ping\ndata: keepalive\n\n"
-            await asyncio.sleep(2)
+    async def stream():
+        # Suscribirse antes de leer la base para no perder lo que llegue entremedio.
+        await sync_to_async(get_broker().escuchar, thread_sensitive=False)()
+        entregados = Entregados(last_id)
+        with hub.suscribir(pk) as suscripcion:
+            yield b": stream-start\n\n"
+            await presencia.alatido(user.pk)
+
+            for data in await amensajes_desde(pk, entregados.piso):
+                if entregados.nuevo(data["id"]):
+                    yield evento(data)
+
+            while True:
+                await presencia.alatido(user.pk)
+                try:
+                    data = await asyncio.wait_for(suscripcion.siguiente(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield b"event: ping\ndata: keepalive\n\n"
+                    continue
+
+                if data is DESBORDE:
+                    for data in await amensajes_desde(pk, entregados.piso):
+                        if entregados.nuevo(data["id"]):
+                            yield evento(data)
+                    continue
+
+                if "evento" in data:
+                    yield evento(data)
+                    continue
+                # Puede tener un id menor que el último entregado si se confirmó tarde.
+                if entregados.nuevo(data["id"]):
+                    yield evento(data)
 
     resp = StreamingHttpResponse(stream(), content_type="text/event-stream")
     resp["Cache-Control"] = "no-cache"
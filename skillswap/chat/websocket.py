@@ -0,0 +1,190 @@
+"""Transporte WebSocket del chat, como aplicación ASGI sin channel layer.
+
+Se monta en `skillswap.asgi` en `/ws/chat/`. El token va en `?token=` o en la
+cabecera `Authorization: Token ...`. Cada frame es un objeto JSON con `tipo`:
+
+- `suscribir` {conversacion, ultimo_id}: recibe los mensajes desde `ultimo_id`
+  y luego en vivo, igual que el stream SSE.
+- `desuscribir` {conversacion}
+- `enviar` {conversacion, contenido, ref}: responde `enviado` con el mensaje.
+- `leer` {conversacion, hasta}: avanza el cursor de lectura hasta ese mensaje.
+- `escribiendo` {conversacion}: avisa a los demás que el usuario está escribiendo.
+- `ping`: responde `pong`. Cualquier frame mantiene al usuario en línea (ver
+  `chat.presencia`), así que un cliente inactivo debe enviar pings.
+
+Los errores se responden con `error` {detail, status, ref} sin cerrar la conexión.
+Las reglas de acceso son las de la API (ver `chat.servicios`).
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import APIException
+
+from .acceso import aacceso_conversacion, ausuario_por_token
+from .broker import get_broker
+from .hub import DESBORDE, Entregados, hub
+from .presencia import presencia
+from .servicios import amensajes_desde, avisar_escribiendo, enviar_mensaje, marcar_leidos
+
+logger = logging.getLogger(__name__)
+
+CIERRE_SIN_TOKEN = 4401
+
+
+def _token(scope):
+    token = parse_qs(scope.get("query_string", b"").decode()).get("token")
+    if token:
+        return token[0]
+    for nombre, valor in scope.get("headers", []):
+        if nombre == b"authorization":
+            valor = valor.decode("latin-1")
+            if valor.startswith("Token "):
+                return valor.split(" ", 1)[1]
+    return None
+
+
+class ConexionChat:
+    def __init__(self, usuario, send):
+        self.usuario = usuario
+        self._send = send
+        self._lock_envio = asyncio.Lock()
+        self._suscripciones = {}
+
+    async def enviar(self, datos):
+        async with self._lock_envio:
+            await self._send({"type": "websocket.send", "text": json.dumps(datos)})
+
+    async def error(self, detalle, status, ref=None):
+        await self.enviar({"tipo": "error", "detail": detalle, "status": status, "ref": ref})
+
+    async def recibir(self, texto):
+        await presencia.alatido(self.usuario.pk)
+        try:
+            frame = json.loads(texto)
+            tipo = frame["tipo"]
+        except (TypeError, ValueError, KeyError):
+            await self.error("Frame inválido.", 400)
+            return
+
+        ref = frame.get("ref")
+        manejador = self.manejadores.get(tipo) if isinstance(tipo, str) else None
+        if manejador is None:
+            await self.error("Tipo desconocido.", 400, ref)
+            return
+        try:
+            await manejador(self, frame)
+        except APIException as error:
+            await self.error(error.detail, error.status_code, ref)
+        except (KeyError, TypeError, ValueError):
+            await self.error("Frame inválido.", 400, ref)
+        except Exception:
+            # Un frame que rompe algo no debe cerrar la conexión.
+            logger.exception("Error al procesar un frame %s", tipo)
+            await self.error("Error interno.", 500, ref)
+
+    async def _ping(self, frame):
+        await self.enviar({"tipo": "pong", "ref": frame.get("ref")})
+
+    async def _enviar(self, frame):
+        datos = await sync_to_async(enviar_mensaje)(self.usuario, frame["conversacion"], frame.get("contenido"))
+        await self.enviar({"tipo": "enviado", "ref": frame.get("ref"), "mensaje": datos})
+
+    async def _leer(self, frame):
+        hasta = int(frame["hasta"])
+        avanzo = await sync_to_async(marcar_leidos)(self.usuario, frame["conversacion"], hasta)
+        await self.enviar({"tipo": "leidos", "ref": frame.get("ref"), "hasta": hasta, "avanzo": avanzo})
+
+    async def _escribiendo(self, frame):
+        await sync_to_async(avisar_escribiendo)(self.usuario, frame["conversacion"])
+
+    async def _suscribir(self, frame):
+        conversacion_id = int(frame["conversacion"])
+        acceso = await aacceso_conversacion(self.usuario, conversacion_id)
+        if acceso is None or not acceso["es_participante"]:
+            await self.error("Conversación no encontrada.", 404, frame.get("ref"))
+            return
+        if acceso["sin_match"]:
+            await self.error("Solo chateas con usuarios con match.", 403, frame.get("ref"))
+            return
+
+        anterior = self._suscripciones.pop(conversacion_id, None)
+        if anterior is not None:
+            anterior.cancel()
+        await sync_to_async(get_broker().escuchar, thread_sensitive=False)()
+        self._suscripciones[conversacion_id] = asyncio.create_task(
+            self._reenviar(conversacion_id, int(frame.get("ultimo_id") or 0))
+        )
+
+    async def _desuscribir(self, frame):
+        tarea = self._suscripciones.pop(int(frame["conversacion"]), None)
+        if tarea is not None:
+            tarea.cancel()
+
+    async def _reenviar(self, conversacion_id, ultimo_id):
+        entregados = Entregados(ultimo_id)
+        try:
+            with hub.suscribir(conversacion_id) as suscripcion:
+                await self.enviar({"tipo": "suscrito", "conversacion": conversacion_id})
+                for datos in await amensajes_desde(conversacion_id, entregados.piso):
+                    if entregados.nuevo(datos["id"]):
+                        await self.enviar({"tipo": "mensaje", "mensaje": datos})
+
+                while True:
+                    datos = await suscripcion.siguiente()
+                    if datos is DESBORDE:
+                        for datos in await amensajes_desde(conversacion_id, entregados.piso):
+                            if entregados.nuevo(datos["id"]):
+                                await self.enviar({"tipo": "mensaje", "mensaje": datos})
+                    elif "evento" in datos:
+                        await self.enviar({**datos, "tipo": datos["evento"]})
+                    elif entregados.nuevo(datos["id"]):
+                        await self.enviar({"tipo": "mensaje", "mensaje": datos})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # El cliente ya se fue o el envío falló; la conexión se cierra por su lado.
+            logger.exception("Se detuvo la suscripción a la conversación %s", conversacion_id)
+
+    manejadores = {
+        "ping": _ping,
+        "enviar": _enviar,
+        "leer": _leer,
+        "escribiendo": _escribiendo,
+        "suscribir": _suscribir,
+        "desuscribir": _desuscribir,
+    }
+
+    def cerrar(self):
+        for tarea in self._suscripciones.values():
+            tarea.cancel()
+        self._suscripciones.clear()
+
+
+async def chat_websocket(scope, receive, send):
+    evento = await receive()
+    if evento["type"] != "websocket.connect":
+        return
+
+    usuario = None
+    token = _token(scope)
+    if token:
+        usuario = await ausuario_por_token(token)
+    if usuario is None:
+        await send({"type": "websocket.close", "code": CIERRE_SIN_TOKEN})
+        return
+
+    await send({"type": "websocket.accept"})
+    conexion = ConexionChat(usuario, send)
+    await presencia.alatido(usuario.pk)
+    try:
+        while True:
+            evento = await receive()
+            if evento["type"] == "websocket.disconnect":
+                break
+            if evento["type"] == "websocket.receive":
+                await conexion.recibir(evento.get("text") or evento.get("bytes"))
+    finally:
+        conexion.cerrar()
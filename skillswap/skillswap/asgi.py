@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'skillswap.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Se importa después de cargar Django: usa los modelos del chat.
+from chat.websocket import chat_websocket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        if scope["path"].rstrip("/") == "/ws/chat":
+            return await chat_websocket(scope, receive, send)
+        await receive()
+        return await send({"type": "websocket.close"})
+    return await django_application(scope, receive, send)
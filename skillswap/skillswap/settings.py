@@ -137,9 +137,65 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Aplica a todo el proyecto (Django >= 5.1): cada `atomic()` abre con
+        # BEGIN IMMEDIATE y toma el lock de escritura al empezar. SQLite admite un
+        # solo escritor igual; lo que cambia es que quien espera lo hace en el
+        # BEGIN, respetando `timeout`. Con el BEGIN diferido de siempre, una
+        # transacción que lee y luego escribe falla con "database is locked" si
+        # otra escribió entremedio, y SQLite no la reintenta. Así trabajan
+        # `bandeja_salida.reclamar`, `SolicitudMatch.responder_en_lote`,
+        # `recalcular_coincidencias` y `chat.servicios.marcar_leidos`. Con Postgres
+        # esta opción no existe: allí bloquean `select_for_update` y los UPDATE
+        # condicionales.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
     }
 }
 
+# Motor de /api/usuarios/coincidencias/: "tabla" (CoincidenciaUsuario) o "memoria"
+# (bitsets en el proceso, ver usuarios.motor_coincidencias).
+COINCIDENCIAS_BACKEND = "tabla"
+COINCIDENCIAS_MEMORIA_TTL = 300
+
+# Búsqueda de /api/usuarios/buscar/ (ver usuarios.busqueda). Sin BUSQUEDA_BACKEND se
+# elige según la base de datos: FTS5 en SQLite, pg_trgm/tsvector en Postgres.
+BUSQUEDA_BACKEND = None
+BUSQUEDA_MAX_RESULTADOS = 200
+
+# Segundos que se conserva un listado de catálogo ya renderizado (ver usuarios.catalogo).
+CATALOGO_CACHE_TIMEOUT = 300
+
+# Bandeja de salida (ver usuarios.bandeja_salida y el comando procesar_bandeja_salida):
+# intentos por evento, espera inicial entre reintentos y segundos que un lote queda
+# apartado para el proceso que lo reclamó. NOTIFICACIONES_ENTREGA lista las funciones
+# que entregan las notificaciones nuevas fuera de la app (push, correo).
+BANDEJA_SALIDA_MAX_INTENTOS = 8
+BANDEJA_SALIDA_ESPERA = 30
+BANDEJA_SALIDA_PLAZO = 300
+NOTIFICACIONES_ENTREGA = []
+
+# Stream SSE del chat (ver chat.hub): segundos entre pings, mensajes en cola por
+# stream y mensajes recientes que se guardan por conversación para Last-Event-ID.
+CHAT_SSE_KEEPALIVE = 15
+CHAT_HUB_MAX_COLA = 100
+CHAT_HUB_HISTORIAL = 50
+CHAT_HUB_MAX_CONVERSACIONES = 1000
+
+# Reparto de mensajes entre workers (ver chat.broker): BrokerMemoria para un solo
+# proceso, BrokerUnix para varios workers en el mismo host o BrokerRedis.
+CHAT_BROKER = "chat.broker.BrokerMemoria"
+CHAT_BROKER_DIR = "/tmp/skillswap-chat"
+CHAT_BROKER_REDIS_URL = "redis://localhost:6379/0"
+
+# Archivo en frío de mensajes antiguos (ver chat.archivo y el comando archivar_mensajes).
+CHAT_ARCHIVO_DIR = os.path.join(BASE_DIR, "archivo_chat")
+CHAT_ARCHIVO_DIAS = 180
+
+# Presencia (ver chat.presencia): segundos sin latidos para pasar a desconectado,
+# duración de "escribiendo" y cada cuánto se guarda la última actividad.
+CHAT_PRESENCIA_TTL = 45
+CHAT_ESCRIBIENDO_TTL = 6
+CHAT_PRESENCIA_VOLCADO = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.utils.translation import gettext_lazy as _
 
-from .models import Usuario, SolicitudMatch, Notificacion
+from .models import EventoSalida, Usuario, SolicitudMatch, Notificacion
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -94,3 +94,9 @@ class NotificacionAdmin(admin.ModelAdmin):
     list_display = ("titulo", "usuario", "tipo", "mostrar", "leido", "fecha")
     list_filter = ("tipo", "mostrar", "leido")
     search_fields = ("titulo", "usuario__email")
+
+
+@admin.register(EventoSalida)
+class EventoSalidaAdmin(admin.ModelAdmin):
+    list_display = ("tipo", "creado_en", "disponible_en", "intentos")
+    list_filter = ("tipo",)
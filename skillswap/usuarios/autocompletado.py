@@ -0,0 +1,88 @@
+"""Índice de prefijos en memoria para autocompletar el catálogo de habilidades.
+
+Cada nombre se inserta desde el inicio de cada palabra, sin tildes ni mayúsculas,
+y cada nodo del trie guarda ya ordenadas sus mejores `MAX_SUGERENCIAS`
+sugerencias, de modo que responder es recorrer el prefijo y copiar una lista.
+Se reconstruye de forma perezosa cuando cambia la versión del catálogo de
+habilidades. Esa versión está en la base (ver `usuarios.catalogo`), así que cada
+worker reconstruye su trie en la primera sugerencia después de cualquier
+escritura confirmada, la haya atendido él o no; el costo por sugerencia es una
+lectura por clave primaria.
+"""
+import threading
+import unicodedata
+from bisect import insort
+
+from .catalogo import HABILIDADES, version_catalogo
+from .models import Habilidad
+from .serializers import HabilidadSerializer
+
+MAX_SUGERENCIAS = 20
+
+
+def normalizar(texto):
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).casefold()
+
+
+class _Nodo:
+    __slots__ = ("hijos", "sugerencias")
+
+    def __init__(self):
+        self.hijos = {}
+        self.sugerencias = []
+
+
+class IndicePrefijos:
+    def __init__(self, max_sugerencias=MAX_SUGERENCIAS):
+        self.max_sugerencias = max_sugerencias
+        self._lock = threading.Lock()
+        self._raiz = None
+        self._version = None
+        self._datos = {}
+
+    def _insertar(self, clave, orden, item_id):
+        nodo = self._raiz
+        for caracter in clave:
+            nodo = nodo.hijos.setdefault(caracter, _Nodo())
+            sugerencias = nodo.sugerencias
+            if any(existente[-1] == item_id for existente in sugerencias):
+                continue
+            if len(sugerencias) < self.max_sugerencias or orden < sugerencias[-1]:
+                insort(sugerencias, orden)
+                del sugerencias[self.max_sugerencias:]
+
+    def _construir(self, version):
+        self._version = version
+        self._raiz = _Nodo()
+        self._datos = {}
+        for dato in HabilidadSerializer(Habilidad.objects.select_related("tipo"), many=True).data:
+            nombre = normalizar(dato["nombre_habilidad"])
+            self._datos[dato["id"]] = dato
+            inicio_palabra = True
+            for posicion, caracter in enumerate(nombre):
+                if caracter.isalnum() and inicio_palabra:
+                    # Primero lo que empieza por el prefijo, después coincidencias de otras palabras.
+                    self._insertar(nombre[posicion:], (posicion > 0, nombre, dato["id"]), dato["id"])
+                inicio_palabra = not caracter.isalnum()
+
+    def invalidar(self):
+        with self._lock:
+            self._raiz = None
+
+    def sugerir(self, prefijo, limite=10):
+        clave = normalizar(prefijo).strip()
+        # Se lee en cada llamada: es la misma para todos los workers.
+        version = version_catalogo(HABILIDADES)
+        with self._lock:
+            if self._raiz is None or version != self._version:
+                self._construir(version)
+            nodo = self._raiz
+            for caracter in clave:
+                nodo = nodo.hijos.get(caracter)
+                if nodo is None:
+                    return []
+            return [self._datos[item_id] for *_, item_id in nodo.sugerencias[:limite]]
+
+
+indice_habilidades = IndicePrefijos()
@@ -0,0 +1,177 @@
+"""Bandeja de salida: trabajo que se confirma con la petición pero se hace después.
+
+Quien necesita notificar escribe un `EventoSalida` en su misma transacción, así
+que si la transacción se revierte el evento tampoco existe. El comando
+`procesar_bandeja_salida` reclama los eventos por lotes, los agrupa por tipo y
+llama al manejador de cada tipo con todo el grupo, en un pool de hilos. El
+manejador y el borrado de sus eventos van en una sola transacción, salvo en las
+entregas: esas hablan con servicios externos y no deben tener la base bloqueada
+mientras tanto, así que son "al menos una vez".
+
+Si un grupo falla se reintenta evento por evento; los que siguen fallando
+vuelven a la cola con una espera que se duplica en cada intento. Tras
+`BANDEJA_SALIDA_MAX_INTENTOS` quedan con `disponible_en` nulo, para revisarlos
+en el admin.
+
+Las entregas fuera de la app (push, correo, ...) se configuran en
+`NOTIFICACIONES_ENTREGA`: rutas a funciones que reciben una lista de
+`Notificacion` ya guardadas. Cada canal recibe su propio evento, así que si uno
+falla se reintenta solo ese canal y las notificaciones no se duplican.
+"""
+import logging
+import traceback
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import (
+    EVENTO_ENTREGAR_NOTIFICACIONES,
+    EVENTO_SOLICITUD_CREADA,
+    EVENTO_SOLICITUD_RESPONDIDA,
+    EventoSalida,
+    Notificacion,
+    NotificacionTipo,
+    SolicitudMatch,
+    SolicitudMatchEstado,
+)
+
+logger = logging.getLogger(__name__)
+
+MANEJADORES = {}
+
+
+def manejador(tipo, transaccional=True):
+    def registrar(funcion):
+        MANEJADORES[tipo] = (funcion, transaccional)
+        return funcion
+    return registrar
+
+
+def _crear_notificaciones(notificaciones):
+    creadas = Notificacion.objects.bulk_create(notificaciones)
+    ids = [n.pk for n in creadas]
+    if ids:
+        EventoSalida.encolar(
+            EVENTO_ENTREGAR_NOTIFICACIONES,
+            *({"canal": canal, "notificaciones": ids} for canal in getattr(settings, "NOTIFICACIONES_ENTREGA", [])),
+        )
+
+
+@manejador(EVENTO_SOLICITUD_CREADA)
+def notificar_solicitudes_creadas(eventos):
+    solicitudes = SolicitudMatch.objects.select_related("emisor").filter(
+        pk__in={evento.datos["solicitud"] for evento in eventos}
+    )
+    _crear_notificaciones([
+        Notificacion(
+            titulo=f"{solicitud.emisor} quiere hacer match contigo",
+            tipo=NotificacionTipo.SOLICITUD_MATCH,
+            contexto=solicitud,
+            usuario_id=solicitud.recipiente_id,
+            # Si ya se respondió mientras esperaba en la bandeja, no hay nada que mostrar.
+            mostrar=solicitud.estado == SolicitudMatchEstado.INDEFINIDO,
+        )
+        for solicitud in solicitudes
+    ])
+
+
+@manejador(EVENTO_SOLICITUD_RESPONDIDA)
+def notificar_solicitudes_respondidas(eventos):
+    solicitudes = SolicitudMatch.objects.select_related("recipiente").filter(
+        pk__in={evento.datos["solicitud"] for evento in eventos}
+    )
+    _crear_notificaciones([solicitud._aviso_respuesta() for solicitud in solicitudes])
+
+
+@manejador(EVENTO_ENTREGAR_NOTIFICACIONES, transaccional=False)
+def entregar_notificaciones(eventos):
+    por_canal = defaultdict(set)
+    for evento in eventos:
+        por_canal[evento.datos["canal"]].update(evento.datos["notificaciones"])
+    for canal, ids in por_canal.items():
+        entregar = import_string(canal)
+        entregar(list(Notificacion.objects.select_related("usuario").filter(pk__in=ids)))
+
+
+def reclamar(tamano_lote):
+    """Toma hasta `tamano_lote` eventos disponibles y los aparta por `BANDEJA_SALIDA_PLAZO` segundos.
+
+    Si el proceso muere a mitad de camino, los eventos vuelven a estar
+    disponibles al vencer el plazo.
+    """
+    ahora = timezone.now()
+    plazo = timedelta(seconds=getattr(settings, "BANDEJA_SALIDA_PLAZO", 300))
+    with transaction.atomic():
+        eventos = list(
+            EventoSalida.objects.select_for_update(skip_locked=True)
+            .filter(disponible_en__lte=ahora)
+            .order_by("disponible_en", "id")[:tamano_lote]
+        )
+        EventoSalida.objects.filter(pk__in=[evento.pk for evento in eventos]).update(disponible_en=ahora + plazo)
+    return eventos
+
+
+def _intentar(tipo, eventos):
+    """Devuelve None si se procesaron, o el traceback del error."""
+    try:
+        manejar, transaccional = MANEJADORES[tipo]
+        with transaction.atomic() if transaccional else nullcontext():
+            manejar(eventos)
+            EventoSalida.objects.filter(pk__in=[evento.pk for evento in eventos]).delete()
+    except Exception:
+        logger.exception("Falló el procesamiento de %d eventos %s.", len(eventos), tipo)
+        return traceback.format_exc()
+    return None
+
+
+def _registrar_fallo(evento, error):
+    intentos = evento.intentos + 1
+    disponible_en = None
+    if intentos < getattr(settings, "BANDEJA_SALIDA_MAX_INTENTOS", 8):
+        espera = getattr(settings, "BANDEJA_SALIDA_ESPERA", 30) * 2 ** (intentos - 1)
+        disponible_en = timezone.now() + timedelta(seconds=espera)
+    EventoSalida.objects.filter(pk=evento.pk).update(intentos=intentos, disponible_en=disponible_en, error=error)
+
+
+def procesar_grupo(tipo, eventos):
+    """Procesa eventos de un mismo tipo; devuelve cuántos fallaron. Corre en un hilo del pool."""
+    try:
+        error = _intentar(tipo, eventos)
+        if error is None:
+            return 0
+        if len(eventos) == 1:
+            _registrar_fallo(eventos[0], error)
+            return 1
+
+        # Un evento problemático no debe frenar al resto del grupo.
+        fallidos = 0
+        for evento in eventos:
+            error = _intentar(tipo, [evento])
+            if error is not None:
+                _registrar_fallo(evento, error)
+                fallidos += 1
+        return fallidos
+    finally:
+        connections.close_all()
+
+
+def procesar_lote(pool, hilos, tamano_lote=200):
+    """Reclama un lote y lo reparte entre `hilos` tareas del pool. Devuelve (reclamados, fallidos)."""
+    eventos = reclamar(tamano_lote)
+    grupos = defaultdict(list)
+    for evento in eventos:
+        # Las entregas se agrupan además por canal: si uno falla, el reintento no
+        # repite las de los otros.
+        grupos[evento.tipo, evento.datos.get("canal")].append(evento)
+
+    tareas = []
+    for (tipo, _), grupo in grupos.items():
+        paso = max(1, -(-len(grupo) // hilos))
+        for inicio in range(0, len(grupo), paso):
+            tareas.append(pool.submit(procesar_grupo, tipo, grupo[inicio: inicio + paso]))
+    return len(eventos), sum(tarea.result() for tarea in tareas)
@@ -0,0 +1,145 @@
+"""Búsqueda de usuarios por nombre, apellidos y habilidades.
+
+`DocumentoBusqueda` guarda el texto de cada usuario y se mantiene desde
+`usuarios.signals`; cada backend lo consulta con el índice propio de su base de
+datos y devuelve a lo sumo `BUSQUEDA_MAX_RESULTADOS` resultados ordenados por
+relevancia (mayor es mejor). Si había más, `Resultados.truncado` lo indica y la
+API lo informa al cliente.
+"""
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import DocumentoBusqueda, Usuario
+
+Resultado = namedtuple("Resultado", "id relevancia")
+
+
+class Resultados(list):
+    truncado = False
+
+
+TABLA = DocumentoBusqueda._meta.db_table
+PALABRA = re.compile(r"\w+", re.UNICODE)
+
+
+class BackendBusqueda:
+    def buscar(self, termino, limite):
+        raise NotImplementedError
+
+
+class BusquedaSQLite(BackendBusqueda):
+    """FTS5 con prefijos y sin distinguir tildes; ordena por bm25."""
+
+    # Peso de cada columna: nombre, segundo_nombre, apellido, habilidades.
+    pesos = (10.0, 5.0, 10.0, 2.0)
+
+    def buscar(self, termino, limite):
+        palabras = PALABRA.findall(termino)
+        if not palabras:
+            return []
+        consulta = " ".join('"{}"*'.format(palabra.replace('"', '""')) for palabra in palabras)
+        pesos = ", ".join(str(peso) for peso in self.pesos)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, -bm25({TABLA}_fts, {pesos}) AS relevancia FROM {TABLA}_fts "
+                f"WHERE {TABLA}_fts MATCH %s ORDER BY relevancia DESC, rowid LIMIT %s",
+                [consulta, limite],
+            )
+            return [Resultado(*fila) for fila in cursor.fetchall()]
+
+
+class BusquedaPostgres(BackendBusqueda):
+    """Palabras completas con tsvector y coincidencias parciales con pg_trgm."""
+
+    documento = "(nombre || ' ' || segundo_nombre || ' ' || apellido || ' ' || habilidades)"
+
+    def buscar(self, termino, limite):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT usuario_id, GREATEST("
+                f"ts_rank(to_tsvector('simple', {self.documento}), plainto_tsquery('simple', %s)), "
+                f"word_similarity(%s, {self.documento})) AS relevancia "
+                f"FROM {TABLA} "
+                f"WHERE to_tsvector('simple', {self.documento}) @@ plainto_tsquery('simple', %s) "
+                f"OR %s <%% {self.documento} "
+                f"ORDER BY relevancia DESC, usuario_id LIMIT %s",
+                [termino, termino, termino, termino, limite],
+            )
+            return [Resultado(*fila) for fila in cursor.fetchall()]
+
+
+class BusquedaIcontains(BackendBusqueda):
+    """Respaldo para otras bases de datos: recorre la tabla con LIKE, sin ranking."""
+
+    def buscar(self, termino, limite):
+        ids = (
+            DocumentoBusqueda.objects.filter(
+                Q(nombre__icontains=termino)
+                | Q(segundo_nombre__icontains=termino)
+                | Q(apellido__icontains=termino)
+                | Q(habilidades__icontains=termino)
+            )
+            .order_by("usuario_id")
+            .values_list("usuario_id", flat=True)[:limite]
+        )
+        return [Resultado(usuario_id, 0) for usuario_id in ids]
+
+
+BACKENDS = {
+    "sqlite": BusquedaSQLite,
+    "postgresql": BusquedaPostgres,
+}
+
+
+def get_backend():
+    ruta = getattr(settings, "BUSQUEDA_BACKEND", None)
+    if ruta:
+        return import_string(ruta)()
+    return BACKENDS.get(connection.vendor, BusquedaIcontains)()
+
+
+def buscar_usuarios(termino):
+    limite = getattr(settings, "BUSQUEDA_MAX_RESULTADOS", 200)
+    # Uno de más para saber si el tope cortó la lista.
+    resultados = Resultados(get_backend().buscar(termino, limite + 1))
+    if len(resultados) > limite:
+        del resultados[limite:]
+        resultados.truncado = True
+    return resultados
+
+
+def indexar_usuarios(usuario_ids):
+    """Reescribe el documento de búsqueda de los usuarios indicados."""
+    usuario_ids = set(usuario_ids)
+    if not usuario_ids:
+        return
+
+    habilidades = {}
+    for relacion in (Usuario.habilidades_que_se_saben, Usuario.habilidades_por_aprender):
+        for usuario_id, nombre in relacion.through.objects.filter(usuario_id__in=usuario_ids).values_list(
+            "usuario_id", "habilidad__nombre_habilidad"
+        ):
+            habilidades.setdefault(usuario_id, []).append(nombre)
+
+    DocumentoBusqueda.objects.bulk_create(
+        [
+            DocumentoBusqueda(
+                usuario_id=usuario_id,
+                nombre=nombre or "",
+                segundo_nombre=segundo_nombre or "",
+                apellido=apellido or "",
+                habilidades=" ".join(habilidades.get(usuario_id, [])),
+            )
+            for usuario_id, nombre, segundo_nombre, apellido in Usuario.objects.filter(
+                pk__in=usuario_ids
+            ).values_list("pk", "nombre", "segundo_nombre", "apellido")
+        ],
+        update_conflicts=True,
+        unique_fields=["usuario"],
+        update_fields=["nombre", "segundo_nombre", "apellido", "habilidades"],
+    )
@@ -0,0 +1,69 @@
+"""Caché versionada de los catálogos (habilidades y tipos de habilidad).
+
+Cada catálogo tiene un contador en `VersionCatalogo` que `usuarios.signals`
+incrementa dentro de la misma transacción que la escritura, así que todos los
+procesos ven la versión nueva apenas se confirma (y ninguno si se revierte). El
+listado se guarda ya renderizado en la caché de Django bajo su versión, junto con
+un ETag fuerte (hash del cuerpo): una petición repetida solo lee el contador por
+clave primaria, sin serializar, y con `If-None-Match` recibe un 304. La caché
+puede ser local a cada proceso; como mucho cada uno renderiza su propia copia.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import VersionCatalogo
+
+HABILIDADES = "habilidades"
+TIPOS_HABILIDAD = "tipos-habilidad"
+
+
+def version_catalogo(catalogo):
+    version = VersionCatalogo.objects.filter(pk=catalogo).values_list("version", flat=True).first()
+    if version is None:
+        VersionCatalogo.objects.bulk_create([VersionCatalogo(catalogo=catalogo)], ignore_conflicts=True)
+        version = VersionCatalogo.objects.values_list("version", flat=True).get(pk=catalogo)
+    return version
+
+
+def invalidar_catalogo(*catalogos):
+    """Cambia la versión de `catalogos`; se llama dentro de la transacción de la escritura."""
+    actualizados = VersionCatalogo.objects.filter(pk__in=catalogos).update(version=F("version") + 1)
+    if actualizados < len(catalogos):
+        VersionCatalogo.objects.bulk_create(
+            [VersionCatalogo(catalogo=catalogo) for catalogo in catalogos], ignore_conflicts=True
+        )
+
+
+class CatalogoCacheMixin:
+    """Sirve `list` desde la caché versionada cuando la respuesta no está paginada."""
+
+    catalogo = None
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+
+        clave = f"catalogo:{self.catalogo}:{version_catalogo(self.catalogo)}"
+        entrada = cache.get(clave)
+        if entrada is None:
+            datos = self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+            cuerpo = JSONRenderer().render(datos)
+            entrada = (f'"{hashlib.sha256(cuerpo).hexdigest()}"', cuerpo)
+            cache.set(clave, entrada, timeout=getattr(settings, "CATALOGO_CACHE_TIMEOUT", 300))
+
+        etag, cuerpo = entrada
+        etags_cliente = parse_etags(request.headers.get("If-None-Match", ""))
+        if etag in etags_cliente or "*" in etags_cliente:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        if isinstance(request.accepted_renderer, JSONRenderer):
+            return HttpResponse(cuerpo, content_type="application/json", headers={"ETag": etag})
+        return Response(json.loads(cuerpo), headers={"ETag": etag})
@@ -0,0 +1,103 @@
+"""Mantenimiento de la tabla materializada `CoincidenciaUsuario`.
+
+Para un par (usuario, candidato):
+- puede_ensenar: habilidades que el candidato sabe y el usuario quiere aprender.
+- puede_aprender: habilidades que el candidato quiere aprender y el usuario sabe.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import CoincidenciaUsuario, Usuario
+
+HabilidadSabida = Usuario.habilidades_que_se_saben.through
+HabilidadPorAprender = Usuario.habilidades_por_aprender.through
+
+_pendientes = threading.local()
+
+
+def _filas_para(usuario_id):
+    sabe = HabilidadSabida.objects.filter(usuario_id=usuario_id).values("habilidad_id")
+    quiere = HabilidadPorAprender.objects.filter(usuario_id=usuario_id).values("habilidad_id")
+
+    # Cuántas habilidades puede enseñar usuario_id a cada otro usuario, y viceversa.
+    ensena_a = dict(
+        HabilidadPorAprender.objects.filter(habilidad_id__in=sabe)
+        .exclude(usuario_id=usuario_id)
+        .values_list("usuario_id")
+        .annotate(n=Count("pk"))
+    )
+    aprende_de = dict(
+        HabilidadSabida.objects.filter(habilidad_id__in=quiere)
+        .exclude(usuario_id=usuario_id)
+        .values_list("usuario_id")
+        .annotate(n=Count("pk"))
+    )
+
+    filas = {}
+    for otro_id in ensena_a.keys() | aprende_de.keys():
+        ensena = ensena_a.get(otro_id, 0)
+        aprende = aprende_de.get(otro_id, 0)
+        filas[(usuario_id, otro_id)] = (aprende, ensena)
+        filas[(otro_id, usuario_id)] = (ensena, aprende)
+    return filas
+
+
+def recalcular_coincidencias(usuario_ids):
+    """Recalcula todas las filas en las que participa alguno de `usuario_ids`."""
+    usuario_ids = set(usuario_ids)
+    if not usuario_ids:
+        return
+
+    with transaction.atomic():
+        # Las lecturas van en la misma transacción que el reemplazo, para no
+        # guardar filas calculadas con habilidades que otro cambió entremedio.
+        filas = {}
+        for usuario_id in usuario_ids:
+            filas.update(_filas_para(usuario_id))
+
+        CoincidenciaUsuario.objects.filter(
+            Q(usuario_id__in=usuario_ids) | Q(candidato_id__in=usuario_ids)
+        ).delete()
+        CoincidenciaUsuario.objects.bulk_create(
+            [
+                CoincidenciaUsuario(
+                    usuario_id=usuario_id,
+                    candidato_id=candidato_id,
+                    puede_ensenar=ensenar,
+                    puede_aprender=aprender,
+                    total_coincidencias=ensenar + aprender,
+                )
+                for (usuario_id, candidato_id), (ensenar, aprender) in filas.items()
+            ],
+            batch_size=500,
+        )
+
+
+def _ejecutar_pendientes():
+    ids = set(_pendientes.ids)
+    _pendientes.ids.clear()
+    recalcular_coincidencias(ids)
+
+
+def programar_recalculo(usuario_ids):
+    """Agrupa los usuarios afectados y los recalcula una vez al confirmar la transacción."""
+    pendientes = getattr(_pendientes, "ids", None)
+    if pendientes is None:
+        pendientes = _pendientes.ids = set()
+    elif pendientes and not any(
+        funcion is _ejecutar_pendientes for _, funcion, _ in transaction.get_connection().run_on_commit
+    ):
+        # Quedaron ids sin nadie que los ejecute: la transacción que los agregó se
+        # revirtió (Django descarta sus on_commit) y no deben pasar a la siguiente.
+        pendientes.clear()
+    pendientes.update(usuario_ids)
+    transaction.on_commit(_ejecutar_pendientes)
+
+
+def reconstruir_coincidencias(tamano_lote=500):
+    """Reconstruye la tabla completa; útil tras cargas masivas fuera del ORM."""
+    usuario_ids = list(Usuario.objects.order_by("pk").values_list("pk", flat=True))
+    for inicio in range(0, len(usuario_ids), tamano_lote):
+        recalcular_coincidencias(usuario_ids[inicio:inicio + tamano_lote])
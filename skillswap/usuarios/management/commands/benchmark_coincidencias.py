@@ -0,0 +1,109 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from usuarios.models import Habilidad, Usuario
+from usuarios.motor_coincidencias import MotorCoincidencias
+
+
+def coincidencias_orm(usuario):
+    """Consulta agregada original de `UsuarioViewset.coincidencias`."""
+    habilidades_que_sabe = list(usuario.habilidades_que_se_saben.values_list("pk", flat=True))
+    habilidades_por_aprender = list(usuario.habilidades_por_aprender.values_list("pk", flat=True))
+    if not habilidades_que_sabe and not habilidades_por_aprender:
+        return []
+    usuarios_compatibles = (
+        Usuario.objects.exclude(pk=usuario.pk)
+        .annotate(
+            puede_ensenar=Count(
+                "habilidades_que_se_saben",
+                filter=Q(habilidades_que_se_saben__in=habilidades_por_aprender),
+                distinct=True,
+            ),
+            puede_aprender=Count(
+                "habilidades_por_aprender",
+                filter=Q(habilidades_por_aprender__in=habilidades_que_sabe),
+                distinct=True,
+            ),
+        )
+        .filter(Q(puede_ensenar__gt=0) | Q(puede_aprender__gt=0))
+        .annotate(total_coincidencias=F("puede_ensenar") + F("puede_aprender"))
+        .order_by("-total_coincidencias", "-puede_ensenar", "-puede_aprender", "nombre", "pk")
+    )
+    return [(candidato.pk, candidato.puede_ensenar, candidato.puede_aprender) for candidato in usuarios_compatibles]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara la consulta ORM de coincidencias con el motor en memoria sobre datos "
+        "sintéticos. Todo se genera dentro de una transacción que se revierte al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--usuarios", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--habilidades", type=int, default=200)
+        parser.add_argument("--por-usuario", type=int, default=5, help="Habilidades sabidas y buscadas por usuario.")
+        parser.add_argument("--consultas", type=int, default=5)
+        parser.add_argument("--semilla", type=int, default=1)
+
+    def handle(self, *args, **options):
+        for total in options["usuarios"]:
+            with transaction.atomic():
+                self._medir(total, options)
+                transaction.set_rollback(True)
+
+    def _medir(self, total, options):
+        azar = random.Random(options["semilla"])
+        por_usuario = min(options["por_usuario"], options["habilidades"])
+
+        inicio = time.perf_counter()
+        habilidades = Habilidad.objects.bulk_create(
+            Habilidad(nombre_habilidad=f"bench-{i}") for i in range(options["habilidades"])
+        )
+        habilidad_ids = [habilidad.pk for habilidad in habilidades]
+        usuarios = Usuario.objects.bulk_create(
+            (
+                Usuario(email=f"bench-{i}@bench.invalid", nombre=f"Bench {i % 997}", apellido="Bench", password="!")
+                for i in range(total)
+            ),
+            batch_size=5000,
+        )
+        for modelo in (Usuario.habilidades_que_se_saben.through, Usuario.habilidades_por_aprender.through):
+            modelo.objects.bulk_create(
+                (
+                    modelo(usuario_id=usuario.pk, habilidad_id=habilidad_id)
+                    for usuario in usuarios
+                    for habilidad_id in azar.sample(habilidad_ids, por_usuario)
+                ),
+                batch_size=5000,
+            )
+        self.stdout.write(f"\n{total} usuarios generados en {time.perf_counter() - inicio:.1f} s")
+
+        motor = MotorCoincidencias()
+        inicio = time.perf_counter()
+        motor.coincidencias(usuarios[0].pk)
+        self.stdout.write(f"  motor: construcción {time.perf_counter() - inicio:.2f} s")
+
+        tiempos_orm, tiempos_motor = [], []
+        for usuario in azar.sample(usuarios, min(options["consultas"], total)):
+            inicio = time.perf_counter()
+            esperado = coincidencias_orm(usuario)
+            tiempos_orm.append(time.perf_counter() - inicio)
+
+            inicio = time.perf_counter()
+            obtenido = motor.coincidencias(usuario.pk)
+            tiempos_motor.append(time.perf_counter() - inicio)
+            obtenido = [(fila.id, fila.puede_ensenar, fila.puede_aprender) for fila in obtenido]
+
+            if obtenido != esperado:
+                self.stderr.write(self.style.ERROR(f"  resultados distintos para el usuario {usuario.pk}"))
+
+        for nombre, tiempos in (("orm", tiempos_orm), ("motor", tiempos_motor)):
+            self.stdout.write(
+                f"  {nombre}: media {statistics.mean(tiempos) * 1000:.1f} ms, "
+                f"p50 {statistics.median(tiempos) * 1000:.1f} ms, máx {max(tiempos) * 1000:.1f} ms"
+            )
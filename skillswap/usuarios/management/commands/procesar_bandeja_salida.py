@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from usuarios.bandeja_salida import procesar_lote
+
+
+class Command(BaseCommand):
+    help = (
+        "Procesa la bandeja de salida (notificaciones y sus entregas) fuera de las peticiones. "
+        "Queda corriendo salvo con --una-vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=200, help="Eventos reclamados por vuelta.")
+        parser.add_argument("--hilos", type=int, default=4, help="Hilos del pool que procesan cada lote.")
+        parser.add_argument("--intervalo", type=float, default=1.0, help="Segundos de espera con la bandeja vacía.")
+        parser.add_argument("--una-vez", action="store_true", help="Termina cuando no queden eventos disponibles.")
+
+    def handle(self, *args, **options):
+        hilos = max(1, options["hilos"])
+        procesados = fallidos = 0
+        with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="bandeja-salida") as pool:
+            try:
+                while True:
+                    reclamados, fallos = procesar_lote(pool, hilos, options["lote"])
+                    procesados += reclamados - fallos
+                    fallidos += fallos
+                    if reclamados:
+                        continue
+                    if options["una_vez"]:
+                        break
+                    time.sleep(options["intervalo"])
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(self.style.SUCCESS(f"Eventos procesados: {procesados}; con error: {fallidos}."))
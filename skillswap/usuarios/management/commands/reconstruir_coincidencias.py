@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from usuarios.coincidencias import reconstruir_coincidencias
+from usuarios.models import CoincidenciaUsuario
+
+
+class Command(BaseCommand):
+    help = "Reconstruye la tabla materializada de coincidencias entre usuarios."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=500, help="Usuarios recalculados por transacción.")
+
+    def handle(self, *args, **options):
+        reconstruir_coincidencias(tamano_lote=options["lote"])
+        total = CoincidenciaUsuario.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"Coincidencias reconstruidas: {total} pares."))
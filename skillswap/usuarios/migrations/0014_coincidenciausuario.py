@@ -0,0 +1,65 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def poblar_coincidencias(apps, schema_editor):
+    Usuario = apps.get_model('usuarios', 'Usuario')
+    CoincidenciaUsuario = apps.get_model('usuarios', 'CoincidenciaUsuario')
+    HabilidadSabida = Usuario.habilidades_que_se_saben.through
+
+    # (a, b, n): a sabe n habilidades que b quiere aprender.
+    ensena = (
+        HabilidadSabida.objects.filter(habilidad__usuarios_que_quieren_aprender__isnull=False)
+        .values_list('usuario_id', 'habilidad__usuarios_que_quieren_aprender')
+        .annotate(n=Count('pk'))
+    )
+    filas = {}
+    for maestro_id, aprendiz_id, n in ensena:
+        if maestro_id == aprendiz_id:
+            continue
+        filas.setdefault((aprendiz_id, maestro_id), [0, 0])[0] += n
+        filas.setdefault((maestro_id, aprendiz_id), [0, 0])[1] += n
+
+    CoincidenciaUsuario.objects.bulk_create(
+        [
+            CoincidenciaUsuario(
+                usuario_id=usuario_id,
+                candidato_id=candidato_id,
+                puede_ensenar=ensenar,
+                puede_aprender=aprender,
+                total_coincidencias=ensenar + aprender,
+            )
+            for (usuario_id, candidato_id), (ensenar, aprender) in filas.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0013_notificacion_descripcion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoincidenciaUsuario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puede_ensenar', models.PositiveIntegerField(default=0)),
+                ('puede_aprender', models.PositiveIntegerField(default=0)),
+                ('total_coincidencias', models.PositiveIntegerField(default=0)),
+                ('candidato', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coincidencias_como_candidato', to=settings.AUTH_USER_MODEL)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coincidencias', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['usuario', '-total_coincidencias', '-puede_ensenar', '-puede_aprender'], name='coincidencia_ranking_idx')],
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'candidato'), name='coincidencia_usuario_unica')],
+            },
+        ),
+        migrations.RunPython(poblar_coincidencias, migrations.RunPython.noop),
+    ]
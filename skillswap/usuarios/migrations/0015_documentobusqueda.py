@@ -0,0 +1,101 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+TABLA = 'usuarios_documentobusqueda'
+COLUMNAS = ('nombre', 'segundo_nombre', 'apellido', 'habilidades')
+DOCUMENTO_PG = "(nombre || ' ' || segundo_nombre || ' ' || apellido || ' ' || habilidades)"
+
+
+def crear_indices(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    columnas = ', '.join(COLUMNAS)
+    nuevas = ', '.join(f'new.{c}' for c in COLUMNAS)
+    viejas = ', '.join(f'old.{c}' for c in COLUMNAS)
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {TABLA}_fts USING fts5({columnas}, content='{TABLA}', "
+            f"content_rowid='usuario_id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {TABLA}_ai AFTER INSERT ON {TABLA} BEGIN "
+            f"INSERT INTO {TABLA}_fts(rowid, {columnas}) VALUES (new.usuario_id, {nuevas}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {TABLA}_ad AFTER DELETE ON {TABLA} BEGIN "
+            f"INSERT INTO {TABLA}_fts({TABLA}_fts, rowid, {columnas}) VALUES ('delete', old.usuario_id, {viejas}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {TABLA}_au AFTER UPDATE ON {TABLA} BEGIN "
+            f"INSERT INTO {TABLA}_fts({TABLA}_fts, rowid, {columnas}) VALUES ('delete', old.usuario_id, {viejas}); "
+            f"INSERT INTO {TABLA}_fts(rowid, {columnas}) VALUES (new.usuario_id, {nuevas}); END"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX {TABLA}_trgm ON {TABLA} USING gin ({DOCUMENTO_PG} gin_trgm_ops)'
+        )
+        schema_editor.execute(
+            f"CREATE INDEX {TABLA}_tsv ON {TABLA} USING gin (to_tsvector('simple', {DOCUMENTO_PG}))"
+        )
+
+
+def eliminar_indices(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for trigger in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {TABLA}_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLA}_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {TABLA}_trgm')
+        schema_editor.execute(f'DROP INDEX IF EXISTS {TABLA}_tsv')
+
+
+def poblar_documentos(apps, schema_editor):
+    Usuario = apps.get_model('usuarios', 'Usuario')
+    DocumentoBusqueda = apps.get_model('usuarios', 'DocumentoBusqueda')
+
+    habilidades = {}
+    for relacion in (Usuario.habilidades_que_se_saben.through, Usuario.habilidades_por_aprender.through):
+        for usuario_id, nombre in relacion.objects.values_list('usuario_id', 'habilidad__nombre_habilidad'):
+            habilidades.setdefault(usuario_id, []).append(nombre)
+
+    DocumentoBusqueda.objects.bulk_create(
+        [
+            DocumentoBusqueda(
+                usuario_id=usuario_id,
+                nombre=nombre or '',
+                segundo_nombre=segundo_nombre or '',
+                apellido=apellido or '',
+                habilidades=' '.join(habilidades.get(usuario_id, [])),
+            )
+            for usuario_id, nombre, segundo_nombre, apellido in Usuario.objects.values_list(
+                'pk', 'nombre', 'segundo_nombre', 'apellido'
+            )
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0014_coincidenciausuario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentoBusqueda',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='documento_busqueda', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('nombre', models.CharField(blank=True, default='', max_length=100)),
+                ('segundo_nombre', models.CharField(blank=True, default='', max_length=100)),
+                ('apellido', models.CharField(blank=True, default='', max_length=100)),
+                ('habilidades', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.RunPython(crear_indices, eliminar_indices),
+        migrations.RunPython(poblar_documentos, migrations.RunPython.noop),
+    ]
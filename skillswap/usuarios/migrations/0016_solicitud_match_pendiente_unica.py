@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:50
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def quitar_pendientes_duplicadas(apps, schema_editor):
+    # Deja solo la más reciente de cada par (emisor, recipiente) pendiente.
+    SolicitudMatch = apps.get_model('usuarios', 'SolicitudMatch')
+    pendientes = SolicitudMatch.objects.filter(estado='indefinido')
+    duplicadas = (
+        pendientes.values('emisor_id', 'recipiente_id')
+        .annotate(ultima=Max('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for par in duplicadas:
+        pendientes.filter(
+            emisor_id=par['emisor_id'], recipiente_id=par['recipiente_id'], id__lt=par['ultima']
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0015_documentobusqueda'),
+    ]
+
+    operations = [
+        migrations.RunPython(quitar_pendientes_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='solicitudmatch',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'indefinido')), fields=('emisor', 'recipiente'), name='solicitud_match_pendiente_unica'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0016_solicitud_match_pendiente_unica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoSalida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50)),
+                ('datos', models.JSONField(default=dict)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('disponible_en', models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['disponible_en', 'id'], name='evento_salida_disponible_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0017_eventosalida'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['usuario', 'mostrar', 'leido'], name='notificacion_no_leidas_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0018_notificacion_no_leidas_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuario',
+            name='ultima_actividad',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:01
+
+import usuarios.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0019_usuario_ultima_actividad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionCatalogo',
+            fields=[
+                ('catalogo', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=usuarios.models._version_inicial)),
+            ],
+        ),
+    ]
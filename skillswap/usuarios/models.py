@@ -1,8 +1,11 @@
+import time
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import RegexValidator
 from django.db import transaction
+from django.utils import timezone
 
 
 class TipoHabilidad(models.Model):
@@ -20,6 +23,21 @@ class Habilidad(models.Model):
         return self.nombre_habilidad
 
 
+def _version_inicial():
+    # Un valor nuevo por fila, para no reutilizar entradas de caché de una base anterior.
+    return time.time_ns()
+
+
+class VersionCatalogo(models.Model):
+    """Contador de versión de un catálogo (ver `usuarios.catalogo`), compartido por todos los procesos."""
+
+    catalogo = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=_version_inicial)
+
+    def __str__(self):
+        return f"{self.catalogo} v{self.version}"
+
+
 class UsuarioManager(BaseUserManager):
     use_in_migrations = True
     def _create_user(self, email, password, **extra_fields):
@@ -106,6 +124,8 @@ class Usuario(AbstractUser):
         "self",
         blank=True,
     )
+    # Última actividad en el chat (ver chat.presencia); no toca last_login.
+    ultima_actividad = models.DateTimeField(blank=True, null=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ["nombre", "apellido"]
@@ -120,12 +140,63 @@ class Usuario(AbstractUser):
         return f"https://wa.me/{numero}" if numero else None
 
 
+class CoincidenciaUsuario(models.Model):
+    """Puntaje materializado de `candidato` visto desde `usuario`.
+
+    Se mantiene desde `usuarios.coincidencias` cuando cambian las habilidades
+    de cualquiera de los dos; solo se guardan pares con al menos una coincidencia.
+    """
+
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="coincidencias")
+    candidato = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="coincidencias_como_candidato")
+    puede_ensenar = models.PositiveIntegerField(default=0)
+    puede_aprender = models.PositiveIntegerField(default=0)
+    total_coincidencias = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["usuario", "candidato"], name="coincidencia_usuario_unica"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["usuario", "-total_coincidencias", "-puede_ensenar", "-puede_aprender"],
+                name="coincidencia_ranking_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Coincidencia {self.usuario_id} -> {self.candidato_id} ({self.total_coincidencias})"
+
+
+class DocumentoBusqueda(models.Model):
+    """Texto desnormalizado de un usuario para `usuarios.busqueda`.
+
+    En SQLite lo indexa una tabla FTS5 sincronizada por triggers; en Postgres,
+    índices GIN de trigramas y tsvector (ver migración 0015).
+    """
+
+    usuario = models.OneToOneField(Usuario, on_delete=models.CASCADE, primary_key=True, related_name="documento_busqueda")
+    nombre = models.CharField(max_length=100, blank=True, default="")
+    segundo_nombre = models.CharField(max_length=100, blank=True, default="")
+    apellido = models.CharField(max_length=100, blank=True, default="")
+    habilidades = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return f"Documento de búsqueda de {self.usuario_id}"
+
+
 class SolicitudMatchEstado(models.TextChoices):
     INDEFINIDO = "indefinido", _("Indefinido")
     ACEPTADO = "aceptado", _("Aceptado")
     RECHAZADO = "rechazado", _("Rechazado")
 
 
+# Tipos de `EventoSalida` (los maneja `usuarios.bandeja_salida`).
+EVENTO_SOLICITUD_CREADA = "solicitud_creada"
+EVENTO_SOLICITUD_RESPONDIDA = "solicitud_respondida"
+EVENTO_ENTREGAR_NOTIFICACIONES = "entregar_notificaciones"
+
+
 class SolicitudMatch(models.Model):
     emisor = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="solicitudes_enviadas")
     recipiente = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name="solicitudes_recibidas")
@@ -142,28 +213,100 @@ class SolicitudMatch(models.Model):
             models.CheckConstraint(
                 condition=~models.Q(emisor=models.F("recipiente")),
                 name="solicitud_match_sin_autosolicitud",
-            )
+            ),
+            models.UniqueConstraint(
+                fields=["emisor", "recipiente"],
+                condition=models.Q(estado=SolicitudMatchEstado.INDEFINIDO),
+                name="solicitud_match_pendiente_unica",
+            ),
         ]
 
     def __str__(self):
         return f"Solicitud de {self.emisor.email} a {self.recipiente.email} - {self.estado}"
 
     def aceptar(self):
-        if self.estado != SolicitudMatchEstado.INDEFINIDO:
-            return
-        with transaction.atomic():
-            self.estado = SolicitudMatchEstado.ACEPTADO
-            self.save(update_fields=["estado", "actualizado_en"])
-            self.notificaciones.update(mostrar=False)
-            self.emisor.matches.add(self.recipiente)
+        """Acepta la solicitud si sigue pendiente; devuelve si esta llamada fue la que respondió."""
+        return self._responder(SolicitudMatchEstado.ACEPTADO)
 
     def rechazar(self):
-        if self.estado != SolicitudMatchEstado.INDEFINIDO:
-            return
+        return self._responder(SolicitudMatchEstado.RECHAZADO)
+
+    def _responder(self, estado):
+        # El UPDATE solo gana si la solicitud sigue indefinida, así que dos respuestas
+        # simultáneas no pueden aplicarse las dos.
+        ahora = timezone.now()
         with transaction.atomic():
-            self.estado = SolicitudMatchEstado.RECHAZADO
-            self.save(update_fields=["estado", "actualizado_en"])
+            respondida = SolicitudMatch.objects.filter(
+                pk=self.pk, estado=SolicitudMatchEstado.INDEFINIDO
+            ).update(estado=estado, actualizado_en=ahora)
+            if not respondida:
+                self.refresh_from_db(fields=["estado", "actualizado_en"])
+                return False
+
+            self.estado, self.actualizado_en = estado, ahora
             self.notificaciones.update(mostrar=False)
+            if estado == SolicitudMatchEstado.ACEPTADO:
+                self.emisor.matches.add(self.recipiente)
+            EventoSalida.encolar(EVENTO_SOLICITUD_RESPONDIDA, {"solicitud": self.pk})
+        return True
+
+    def _aviso_respuesta(self):
+        """Notificación (sin guardar) que le cuenta al emisor la respuesta."""
+        verbo = "aceptó" if self.estado == SolicitudMatchEstado.ACEPTADO else "rechazó"
+        return Notificacion(
+            titulo=f"{self.recipiente} {verbo} tu solicitud de match",
+            tipo=NotificacionTipo.SOLICITUD_MATCH,
+            contexto=self,
+            usuario_id=self.emisor_id,
+            mostrar=True,
+        )
+
+    @classmethod
+    def responder_en_lote(cls, recipiente, ids, estado):
+        """Responde con `estado` las solicitudes pendientes de `recipiente` entre `ids`.
+
+        Hace lo mismo que `aceptar`/`rechazar` en cada una, pero con una cantidad
+        fija de consultas. Las que no son de `recipiente` o ya estaban respondidas
+        se ignoran. Devuelve los ids respondidos.
+        """
+        ahora = timezone.now()
+        with transaction.atomic():
+            emisores = dict(
+                cls.objects.select_for_update()
+                .filter(pk__in=ids, recipiente=recipiente, estado=SolicitudMatchEstado.INDEFINIDO)
+                .values_list("pk", "emisor_id")
+            )
+            if not emisores:
+                return []
+            # `select_for_update` no bloquea nada en SQLite: otra petición pudo responder
+            # alguna entremedio, así que el UPDATE vuelve a exigir que esté pendiente.
+            actualizadas = cls.objects.filter(pk__in=emisores, estado=SolicitudMatchEstado.INDEFINIDO).update(
+                estado=estado, actualizado_en=ahora
+            )
+            if actualizadas < len(emisores):
+                # Tras el UPDATE la fila queda bloqueada hasta el commit; las que tienen
+                # nuestra marca son las que cambió esta transacción.
+                emisores = dict(
+                    cls.objects.filter(pk__in=emisores, estado=estado, actualizado_en=ahora).values_list(
+                        "pk", "emisor_id"
+                    )
+                )
+                if not emisores:
+                    return []
+            Notificacion.objects.filter(contexto_id__in=emisores).update(mostrar=False)
+            if estado == SolicitudMatchEstado.ACEPTADO:
+                # `matches` es simétrico: se guardan las dos direcciones, como en `add`.
+                Match = Usuario.matches.through
+                Match.objects.bulk_create(
+                    [
+                        Match(from_usuario_id=a, to_usuario_id=b)
+                        for emisor_id in set(emisores.values())
+                        for a, b in ((emisor_id, recipiente.pk), (recipiente.pk, emisor_id))
+                    ],
+                    ignore_conflicts=True,
+                )
+            EventoSalida.encolar(EVENTO_SOLICITUD_RESPONDIDA, *({"solicitud": pk} for pk in emisores))
+        return sorted(emisores)
 
 
 class NotificacionTipo(models.TextChoices):
@@ -182,6 +325,37 @@ class Notificacion(models.Model):
 
     class Meta:
         ordering = ["-fecha", "-id"]
+        indexes = [
+            # Cubre el conteo de no leídas (`NotificacionViewset.no_leidas`) sin leer la tabla.
+            models.Index(fields=["usuario", "mostrar", "leido"], name="notificacion_no_leidas_idx"),
+        ]
 
     def __str__(self):
         return f"{self.titulo} ({self.tipo})"
+
+
+class EventoSalida(models.Model):
+    """Trabajo pendiente de la bandeja de salida (ver `usuarios.bandeja_salida`).
+
+    Se escribe en la misma transacción que el cambio que lo origina y lo procesa
+    `procesar_bandeja_salida` fuera de la petición. Al procesarse se borra; si
+    `disponible_en` es nulo, agotó sus intentos.
+    """
+
+    tipo = models.CharField(max_length=50)
+    datos = models.JSONField(default=dict)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    disponible_en = models.DateTimeField(default=timezone.now, null=True, blank=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["disponible_en", "id"], name="evento_salida_disponible_idx")]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.intentos} intentos)"
+
+    @classmethod
+    def encolar(cls, tipo, *datos):
+        """Agrega un evento `tipo` por cada dict de `datos` con un solo INSERT."""
+        cls.objects.bulk_create([cls(tipo=tipo, datos=d) for d in datos])
@@ -0,0 +1,237 @@
+"""Motor de coincidencias en memoria basado en bitsets.
+
+Cada habilidad guarda dos bitsets sobre las posiciones de los usuarios (quiénes la
+saben y quiénes la quieren aprender). Para puntuar a todos los candidatos se suman
+esos bitsets en contadores "bit-sliced": cada plano es un entero de Python y las
+sumas se hacen con AND/XOR sobre todos los usuarios a la vez, sin recorrerlos.
+
+Se activa con `COINCIDENCIAS_BACKEND = "memoria"`; el índice se construye de forma
+perezosa, se reconstruye pasado `COINCIDENCIAS_MEMORIA_TTL` segundos y recibe
+deltas desde `usuarios.signals` cuando cambian las habilidades de un usuario.
+
+Los deltas solo llegan al proceso que confirmó el cambio. Para que los demás
+workers se enteren, cada cambio incrementa la versión `COINCIDENCIAS` de
+`VersionCatalogo` dentro de su transacción, y cada consulta la compara con la del
+índice: si otro proceso la movió, se reconstruye. El proceso que aplica su propio
+delta adopta la versión que él mismo dejó, así que no reconstruye por sus cambios.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from .catalogo import version_catalogo
+from .models import Usuario
+
+HabilidadSabida = Usuario.habilidades_que_se_saben.through
+HabilidadPorAprender = Usuario.habilidades_por_aprender.through
+
+COINCIDENCIAS = "coincidencias"
+
+Coincidencia = namedtuple("Coincidencia", "id puede_ensenar puede_aprender total_coincidencias nombre")
+
+
+def _sumar(planos, bitset):
+    # Suma `bitset` (un 1 por usuario) a los contadores representados por `planos`.
+    acarreo = bitset
+    for nivel, plano in enumerate(planos):
+        if not acarreo:
+            return
+        planos[nivel], acarreo = plano ^ acarreo, plano & acarreo
+    if acarreo:
+        planos.append(acarreo)
+
+
+def _posiciones(bitset):
+    binario = bin(bitset)[:1:-1]
+    posicion = binario.find("1")
+    while posicion != -1:
+        yield posicion
+        posicion = binario.find("1", posicion + 1)
+
+
+class MotorCoincidencias:
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._construido_en = None
+        self._version = None
+
+    def _vaciar(self):
+        self._posiciones = {}
+        self._ids = []
+        self._nombres = []
+        self._sabe = {}
+        self._quiere = {}
+        self._sabida_por = {}
+        self._buscada_por = {}
+
+    def _posicion(self, usuario_id, nombre=""):
+        posicion = self._posiciones.get(usuario_id)
+        if posicion is None:
+            posicion = self._posiciones[usuario_id] = len(self._ids)
+            self._ids.append(usuario_id)
+            self._nombres.append(nombre)
+        return posicion
+
+    def _construir(self):
+        # La versión se lee antes que los datos: un cambio que se confirme en medio
+        # fuerza otra reconstrucción en vez de quedar perdido.
+        self._version = version_catalogo(COINCIDENCIAS)
+        self._vaciar()
+        for usuario_id, nombre in Usuario.objects.order_by("pk").values_list("pk", "nombre"):
+            self._posicion(usuario_id, nombre)
+        for modelo, habilidades, indice in (
+            (HabilidadSabida, self._sabe, self._sabida_por),
+            (HabilidadPorAprender, self._quiere, self._buscada_por),
+        ):
+            for usuario_id, habilidad_id in modelo.objects.values_list("usuario_id", "habilidad_id").iterator():
+                posicion = self._posiciones.get(usuario_id)
+                if posicion is None:
+                    continue
+                habilidades.setdefault(usuario_id, set()).add(habilidad_id)
+                indice[habilidad_id] = indice.get(habilidad_id, 0) | (1 << posicion)
+        self._construido_en = time.monotonic()
+
+    def _asegurar_construido(self, version):
+        vencido = (
+            self.ttl is not None
+            and self._construido_en is not None
+            and time.monotonic() - self._construido_en > self.ttl
+        )
+        if self._construido_en is None or vencido or version != self._version:
+            self._construir()
+
+    def _adoptar_version(self, version):
+        # Solo si no hubo otro cambio en medio; si lo hubo, la próxima consulta reconstruye.
+        if version is not None and self._version == version - 1:
+            self._version = version
+
+    @property
+    def construido(self):
+        return self._construido_en is not None
+
+    def invalidar(self):
+        with self._lock:
+            self._construido_en = None
+
+    def coincidencias(self, usuario_id):
+        """Devuelve los candidatos como `Coincidencia`, en el orden del endpoint."""
+        version = version_catalogo(COINCIDENCIAS)
+        with self._lock:
+            self._asegurar_construido(version)
+            sabe = self._sabe.get(usuario_id, ())
+            quiere = self._quiere.get(usuario_id, ())
+
+            ensenar, aprender = [], []
+            for habilidad_id in quiere:
+                _sumar(ensenar, self._sabida_por.get(habilidad_id, 0))
+            for habilidad_id in sabe:
+                _sumar(aprender, self._buscada_por.get(habilidad_id, 0))
+
+            propio = self._posiciones.get(usuario_id)
+            candidatos = 0
+            for plano in ensenar + aprender:
+                candidatos |= plano
+            if propio is not None:
+                candidatos &= ~(1 << propio)
+            if not candidatos:
+                return []
+
+            ancho = len(self._ids)
+            bits_ensenar = [bin(plano)[:1:-1].ljust(ancho, "0") for plano in ensenar]
+            bits_aprender = [bin(plano)[:1:-1].ljust(ancho, "0") for plano in aprender]
+            ids, nombres = self._ids, self._nombres
+
+            filas = []
+            for posicion in _posiciones(candidatos):
+                puede_ensenar = sum(1 << nivel for nivel, bits in enumerate(bits_ensenar) if bits[posicion] == "1")
+                puede_aprender = sum(1 << nivel for nivel, bits in enumerate(bits_aprender) if bits[posicion] == "1")
+                filas.append((
+                    -(puede_ensenar + puede_aprender),
+                    -puede_ensenar,
+                    -puede_aprender,
+                    nombres[posicion],
+                    ids[posicion],
+                ))
+
+        filas.sort()
+        return [
+            Coincidencia(candidato_id, -ensenar, -aprender, -total, nombre)
+            for total, ensenar, aprender, nombre, candidato_id in filas
+        ]
+
+    def actualizar_usuarios(self, usuario_ids, version=None):
+        """Aplica los cambios de habilidades (o el alta) de los usuarios indicados.
+
+        `version` es la que dejó el cambio en `VersionCatalogo` (ver `usuarios.signals`).
+        """
+        usuario_ids = set(usuario_ids)
+        if not usuario_ids:
+            return
+        with self._lock:
+            if not self.construido:
+                return
+
+            nuevos = {usuario_id: (set(), set()) for usuario_id in usuario_ids}
+            for usuario_id, habilidad_id in HabilidadSabida.objects.filter(
+                usuario_id__in=usuario_ids
+            ).values_list("usuario_id", "habilidad_id"):
+                nuevos[usuario_id][0].add(habilidad_id)
+            for usuario_id, habilidad_id in HabilidadPorAprender.objects.filter(
+                usuario_id__in=usuario_ids
+            ).values_list("usuario_id", "habilidad_id"):
+                nuevos[usuario_id][1].add(habilidad_id)
+            nombres = dict(Usuario.objects.filter(pk__in=usuario_ids).values_list("pk", "nombre"))
+
+            for usuario_id, (sabe, quiere) in nuevos.items():
+                if usuario_id not in nombres:
+                    self._quitar(usuario_id)
+                    continue
+                posicion = self._posicion(usuario_id)
+                self._nombres[posicion] = nombres[usuario_id]
+                self._aplicar(posicion, self._sabe, self._sabida_por, usuario_id, sabe)
+                self._aplicar(posicion, self._quiere, self._buscada_por, usuario_id, quiere)
+            self._adoptar_version(version)
+
+    def _aplicar(self, posicion, habilidades, indice, usuario_id, nuevas):
+        bit = 1 << posicion
+        anteriores = habilidades.get(usuario_id, set())
+        for habilidad_id in anteriores - nuevas:
+            indice[habilidad_id] &= ~bit
+        for habilidad_id in nuevas - anteriores:
+            indice[habilidad_id] = indice.get(habilidad_id, 0) | bit
+        if nuevas:
+            habilidades[usuario_id] = nuevas
+        else:
+            habilidades.pop(usuario_id, None)
+
+    def _quitar(self, usuario_id):
+        posicion = self._posiciones.get(usuario_id)
+        if posicion is None:
+            return
+        self._aplicar(posicion, self._sabe, self._sabida_por, usuario_id, set())
+        self._aplicar(posicion, self._quiere, self._buscada_por, usuario_id, set())
+
+    def quitar_usuario(self, usuario_id, version=None):
+        with self._lock:
+            if self.construido:
+                self._quitar(usuario_id)
+                self._adoptar_version(version)
+
+    def actualizar_nombre(self, usuario_id, nombre, version=None):
+        with self._lock:
+            if not self.construido:
+                return
+            posicion = self._posiciones.get(usuario_id)
+            if posicion is not None:
+                self._nombres[posicion] = nombre
+            self._adoptar_version(version)
+
+
+motor = MotorCoincidencias(ttl=getattr(settings, "COINCIDENCIAS_MEMORIA_TTL", None))
+
+
+def usar_motor_en_memoria():
+    return getattr(settings, "COINCIDENCIAS_BACKEND", "tabla") == "memoria"
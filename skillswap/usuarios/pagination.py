@@ -0,0 +1,162 @@
+import json
+import operator
+from base64 import b64decode, b64encode
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import reduce
+
+from django.db.models import Q, QuerySet
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginación por cursor sobre una clave de orden compuesta.
+
+    El cursor guarda los valores de `ordering` de la última fila entregada y la
+    siguiente página se obtiene con un filtro de rango, sin OFFSET ni COUNT(*).
+    Solo pagina cuando el cliente envía `cursor` o `limit`, para no cambiar la
+    respuesta de quienes todavía esperan la lista completa.
+
+    `ordering` es una secuencia de (campo, descendente); el último campo debe ser
+    único. Con listas ya ordenadas en memoria, los campos descendentes deben ser
+    numéricos. `tipos_cursor` da los tipos aceptados para cada campo, para que un
+    cursor adulterado sea un 404 y no un error al filtrar u ordenar.
+    """
+
+    ordering = ()
+    tipos_cursor = ()
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = _("Cursor inválido.")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        limite = self.get_page_size(request)
+        posicion = self.decode_cursor(request)
+
+        if isinstance(queryset, QuerySet):
+            if posicion is not None:
+                queryset = queryset.filter(self._filtro_posterior(posicion))
+            queryset = queryset.order_by(*(f"-{campo}" if desc else campo for campo, desc in self.ordering))
+            filas = list(queryset[: limite + 1])
+        else:
+            inicio = 0
+            if posicion is not None:
+                inicio = bisect_right(queryset, self._clave_orden(posicion), key=self._clave_fila)
+            filas = list(queryset[inicio: inicio + limite + 1])
+
+        self.next_position = None
+        if len(filas) > limite:
+            filas = filas[:limite]
+            self.next_position = self._valores(filas[-1])
+        return filas
+
+    def get_page_size(self, request):
+        try:
+            limite = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if limite <= 0:
+            return self.page_size
+        return min(limite, self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([("next", self.get_next_link()), ("results", data)]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, posicion):
+        return b64encode(json.dumps(list(posicion)).encode(), altchars=b"-_").decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            posicion = json.loads(b64decode(cursor.encode(), altchars=b"-_"))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(posicion, list) or len(posicion) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        for valor, tipos in zip(posicion, self.tipos_cursor):
+            # bool es subclase de int, pero nunca es un valor válido.
+            if isinstance(valor, bool) or not isinstance(valor, tipos):
+                raise NotFound(self.invalid_cursor_message)
+        return posicion
+
+    def _valores(self, fila):
+        return [getattr(fila, campo) for campo, _ in self.ordering]
+
+    def _filtro_posterior(self, posicion):
+        # (a, b, c) > (x, y, z) respetando la dirección de cada campo.
+        filtros = []
+        iguales = Q()
+        for (campo, desc), valor in zip(self.ordering, posicion):
+            filtros.append(iguales & Q(**{f"{campo}__{'lt' if desc else 'gt'}": valor}))
+            iguales &= Q(**{campo: valor})
+        return reduce(operator.or_, filtros)
+
+    def _clave_orden(self, valores):
+        return tuple(-valor if desc else valor for (_, desc), valor in zip(self.ordering, valores))
+
+    def _clave_fila(self, fila):
+        return self._clave_orden(self._valores(fila))
+
+
+class CoincidenciaCursorPagination(KeysetPagination):
+    ordering = (
+        ("total_coincidencias", True),
+        ("puede_ensenar", True),
+        ("puede_aprender", True),
+        ("nombre", False),
+        ("id", False),
+    )
+    tipos_cursor = (int, int, int, str, int)
+
+
+class BusquedaCursorPagination(KeysetPagination):
+    """Pagina los `busqueda.Resultados`; `truncado` avisa que hay más allá del tope."""
+
+    ordering = (
+        ("relevancia", True),
+        ("id", False),
+    )
+    tipos_cursor = ((int, float), int)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.truncado = getattr(queryset, "truncado", False)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        respuesta = super().get_paginated_response(data)
+        respuesta.data["truncado"] = self.truncado
+        return respuesta
+
+    def get_paginated_response_schema(self, schema):
+        esquema = super().get_paginated_response_schema(schema)
+        esquema["properties"]["truncado"] = {"type": "boolean"}
+        return esquema
@@ -1,5 +1,8 @@
 from rest_framework import serializers
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import Exists, OuterRef, Prefetch, prefetch_related_objects
 from django.utils.translation import gettext_lazy as _
 from .models import (
     Usuario,
@@ -15,13 +18,76 @@ from dj_rest_auth.registration.serializers import RegisterSerializer
 from dj_rest_auth.serializers import UserDetailsSerializer
 from dj_rest_auth.serializers import LoginSerializer
 
-class UsuarioSerializer(serializers.ModelSerializer):
+class CamposDinamicosMixin:
+    """Recorta los campos con `?fields=` y anida relaciones con `?expand=`.
+
+    La vista deja ambos parámetros en el contexto (`campos`, `expandir`) y usa
+    `get_plan_consulta()` para pedir solo las columnas y relaciones que se van a
+    serializar. `dependencias` indica qué usa cada campo que no es del modelo.
+    """
+
+    campos_expandibles = ()
+    dependencias = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for nombre in self.context.get("expandir", ()):
+            if nombre in self.campos_expandibles and nombre in self.fields:
+                self.fields[nombre] = self.get_campo_expandido(nombre)
+        campos = self.context.get("campos")
+        if campos:
+            for nombre in set(self.fields) - set(campos):
+                self.fields.pop(nombre)
+
+    def get_campo_expandido(self, nombre):
+        raise NotImplementedError
+
+    def get_prefetch_queryset(self, relacion):
+        return None
+
+    def get_plan_consulta(self):
+        """Devuelve (columnas para only(), Prefetch para prefetch_related())."""
+        opciones = self.Meta.model._meta
+        columnas = {opciones.pk.name}
+        relaciones = set()
+        for nombre, campo in self.fields.items():
+            fuentes = [] if campo.source == "*" else [campo.source.split(".")[0]]
+            fuentes.extend(self.dependencias.get(nombre, ()))
+            for fuente in fuentes:
+                try:
+                    campo_modelo = opciones.get_field(fuente)
+                except FieldDoesNotExist:
+                    continue
+                if campo_modelo.many_to_many or campo_modelo.one_to_many:
+                    relaciones.add(fuente)
+                elif campo_modelo.concrete:
+                    columnas.add(fuente)
+        prefetch = [
+            Prefetch(relacion, queryset=self.get_prefetch_queryset(relacion))
+            for relacion in sorted(relaciones)
+        ]
+        return sorted(columnas), prefetch
+
+
+class UsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     whatsapp_link = serializers.SerializerMethodField(read_only=True)
     valorado_por = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
+    campos_expandibles = ("habilidades_que_se_saben", "habilidades_por_aprender")
+    dependencias = {"whatsapp_link": ("telefono",)}
+
     class Meta:
         model = Usuario
         fields = "__all__"
+        read_only_fields = ("ultima_actividad",)
+
+    def get_campo_expandido(self, nombre):
+        return HabilidadSerializer(many=True, read_only=True)
+
+    def get_prefetch_queryset(self, relacion):
+        if relacion in self.campos_expandibles:
+            return Habilidad.objects.select_related("tipo")
+        return None
 
     def get_whatsapp_link(self, obj):
         return obj.whatsapp_link
@@ -76,26 +142,44 @@ class SolicitudMatchSerializer(serializers.ModelSerializer):
         if request and request.user and recipiente:
             if request.user == recipiente:
                 raise serializers.ValidationError(_("No puedes enviarte una solicitud a ti mismo."))
-            if request.user.matches.filter(pk=recipiente.pk).exists():
+            estado = self._estado_del_par(request.user, recipiente)
+            if estado["tiene_match"]:
                 raise serializers.ValidationError(_("Ya tienes un match con este usuario."))
-
-            existe_pendiente = SolicitudMatch.objects.filter(
-                emisor=request.user,
-                recipiente=recipiente,
-                estado=SolicitudMatchEstado.INDEFINIDO,
-            ).exists()
-            if existe_pendiente:
+            if estado["pendiente_enviada"]:
                 raise serializers.ValidationError(_("Ya enviaste una solicitud pendiente a este usuario."))
-
-            pendiente_contra = SolicitudMatch.objects.filter(
-                emisor=recipiente,
-                recipiente=request.user,
-                estado=SolicitudMatchEstado.INDEFINIDO,
-            ).exists()
-            if pendiente_contra:
+            if estado["pendiente_recibida"]:
                 raise serializers.ValidationError(_("Tienes una solicitud pendiente de este usuario; respóndela allí."))
         return super().validate(attrs)
 
+    @staticmethod
+    def _estado_del_par(emisor, recipiente):
+        """Match y solicitudes pendientes entre los dos, en una sola consulta.
+
+        Las búsquedas de pendientes usan el índice de `solicitud_match_pendiente_unica`.
+        """
+        pendientes = SolicitudMatch.objects.filter(estado=SolicitudMatchEstado.INDEFINIDO)
+        return (
+            Usuario.objects.filter(pk=recipiente.pk)
+            .annotate(
+                tiene_match=Exists(
+                    Usuario.matches.through.objects.filter(from_usuario_id=emisor.pk, to_usuario_id=OuterRef("pk"))
+                ),
+                pendiente_enviada=Exists(pendientes.filter(emisor_id=emisor.pk, recipiente_id=OuterRef("pk"))),
+                pendiente_recibida=Exists(pendientes.filter(emisor_id=OuterRef("pk"), recipiente_id=emisor.pk)),
+            )
+            .values("tiene_match", "pendiente_enviada", "pendiente_recibida")
+            .get()
+        )
+
+
+class RespuestaSolicitudesSerializer(serializers.Serializer):
+    """Entrada de `SolicitudMatchViewset.responder`."""
+
+    MAX_IDS = 500
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=MAX_IDS)
+    accion = serializers.ChoiceField(choices=["aceptar", "rechazar"])
+
 
 class NotificacionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -111,6 +195,14 @@ class NotificacionSerializer(serializers.ModelSerializer):
         )
 
 
+class MarcarLeidasSerializer(serializers.Serializer):
+    """Entrada de `NotificacionViewset.marcar_leidas`."""
+
+    MAX_IDS = 500
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=MAX_IDS)
+
+
 class CustomRegisterSerializer(RegisterSerializer):
     # Elimina el campo heredado "username" y usa email como identificador
     username = None
@@ -177,13 +269,30 @@ class CustomUserDetailsSerializer(UserDetailsSerializer):
         }
 
 
+class UsuarioCoincidenciaListSerializer(serializers.ListSerializer):
+    """Precarga en bloque las relaciones de la página para no consultar por fila."""
+
+    def to_representation(self, data):
+        usuarios = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        _, prefetch = self.child.get_plan_consulta()
+        prefetch_related_objects(usuarios, *prefetch)
+        return super().to_representation(usuarios)
+
+
 class UsuarioCoincidenciaSerializer(UsuarioSerializer):
     puede_ensenar = serializers.SerializerMethodField()
     puede_aprender = serializers.SerializerMethodField()
 
+    dependencias = {
+        **UsuarioSerializer.dependencias,
+        "puede_ensenar": ("habilidades_que_se_saben",),
+        "puede_aprender": ("habilidades_por_aprender",),
+    }
+
     class Meta(UsuarioSerializer.Meta):
         # Keep base fields; declared SerializerMethodFields are added automatically.
         fields = UsuarioSerializer.Meta.fields
+        list_serializer_class = UsuarioCoincidenciaListSerializer
 
     def _get_request_user(self):
         request = self.context.get("request")
@@ -191,18 +300,35 @@ class UsuarioCoincidenciaSerializer(UsuarioSerializer):
             return request.user
         return None
 
+    def _get_habilidades_usuario(self):
+        # Se cargan una sola vez por serializer; con many=True el hijo se reutiliza en cada fila.
+        if not hasattr(self, "_habilidades_usuario"):
+            user = self._get_request_user()
+            self._habilidades_usuario = None
+            if user:
+                self._habilidades_usuario = (
+                    set(user.habilidades_que_se_saben.values_list("pk", flat=True)),
+                    set(user.habilidades_por_aprender.values_list("pk", flat=True)),
+                )
+        return self._habilidades_usuario
+
+    def _serializar_interseccion(self, obj, relacion, habilidad_ids):
+        if relacion in getattr(obj, "_prefetched_objects_cache", {}):
+            habilidades = [habilidad for habilidad in getattr(obj, relacion).all() if habilidad.pk in habilidad_ids]
+        else:
+            habilidades = getattr(obj, relacion).filter(pk__in=habilidad_ids).select_related("tipo")
+        return HabilidadSerializer(habilidades, many=True).data
+
     def get_puede_ensenar(self, obj):
-        user = self._get_request_user()
-        if not user:
+        habilidades_usuario = self._get_habilidades_usuario()
+        if not habilidades_usuario:
             return []
-        habilidades_deseadas = user.habilidades_por_aprender.values_list("pk", flat=True)
-        habilidades = obj.habilidades_que_se_saben.filter(pk__in=habilidades_deseadas)
-        return HabilidadSerializer(habilidades, many=True).data
+        _, habilidades_deseadas = habilidades_usuario
+        return self._serializar_interseccion(obj, "habilidades_que_se_saben", habilidades_deseadas)
 
     def get_puede_aprender(self, obj):
-        user = self._get_request_user()
-        if not user:
+        habilidades_usuario = self._get_habilidades_usuario()
+        if not habilidades_usuario:
             return []
-        habilidades_que_puedo_ensenar = user.habilidades_que_se_saben.values_list("pk", flat=True)
-        habilidades = obj.habilidades_por_aprender.filter(pk__in=habilidades_que_puedo_ensenar)
-        return HabilidadSerializer(habilidades, many=True).data
+        habilidades_que_puedo_ensenar, _ = habilidades_usuario
+        return self._serializar_interseccion(obj, "habilidades_por_aprender", habilidades_que_puedo_ensenar)
@@ -1,59 +1,117 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.db import transaction
 from django.dispatch import receiver
 
+from .busqueda import indexar_usuarios
+from .catalogo import HABILIDADES, TIPOS_HABILIDAD, invalidar_catalogo, version_catalogo
+from .coincidencias import programar_recalculo
+from .motor_coincidencias import COINCIDENCIAS, motor
 from .models import (
-    Notificacion,
-    NotificacionTipo,
+    EVENTO_SOLICITUD_CREADA,
+    EventoSalida,
+    Habilidad,
     SolicitudMatch,
-    SolicitudMatchEstado,
+    TipoHabilidad,
+    Usuario,
 )
 
 
-@receiver(pre_save, sender=SolicitudMatch)
-def cache_estado_previo(sender, instance, **kwargs):
-    if not instance.pk:
-        instance._estado_previo = None
-        return
-    instance._estado_previo = (
-        sender.objects.filter(pk=instance.pk).values_list("estado", flat=True).first()
-    )
+@receiver(post_save, sender=SolicitudMatch)
+def encolar_notificacion_solicitud_match(sender, instance, created, **kwargs):
+    if created:
+        # La notificación la crea `procesar_bandeja_salida`, fuera de la petición.
+        EventoSalida.encolar(EVENTO_SOLICITUD_CREADA, {"solicitud": instance.pk})
 
 
-@receiver(post_save, sender=SolicitudMatch)
-def crear_notificacion_solicitud_match(sender, instance, created, **kwargs):
-    if not created:
+CAMPOS_BUSQUEDA = {"nombre", "segundo_nombre", "apellido"}
+
+
+def avisar_al_motor(aplicar):
+    """Mueve la versión del motor para los demás procesos y aplica el cambio en este al confirmar."""
+    invalidar_catalogo(COINCIDENCIAS)
+    version = version_catalogo(COINCIDENCIAS)
+    transaction.on_commit(lambda: aplicar(version))
+
+
+def programar_cambio_habilidades(usuario_ids):
+    usuario_ids = set(usuario_ids)
+    programar_recalculo(usuario_ids)
+    avisar_al_motor(lambda version: motor.actualizar_usuarios(usuario_ids, version))
+    transaction.on_commit(lambda: indexar_usuarios(usuario_ids))
+
+
+@receiver(m2m_changed, sender=Usuario.habilidades_que_se_saben.through)
+@receiver(m2m_changed, sender=Usuario.habilidades_por_aprender.through)
+def actualizar_coincidencias(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in {"post_add", "post_remove"} and not pk_set:
         return
 
-    titulo = f"{instance.emisor} quiere hacer match contigo"
-    Notificacion.objects.create(
-        titulo=titulo,
-        tipo=NotificacionTipo.SOLICITUD_MATCH,
-        contexto=instance,
-        usuario=instance.recipiente,
-        mostrar=True,
-    )
+    if not reverse:
+        if action in {"post_add", "post_remove", "post_clear"}:
+            programar_cambio_habilidades({instance.pk})
+        return
 
+    # Cambios desde Habilidad (p. ej. habilidad.usuarios_que_saben.add(...)): pk_set son usuarios.
+    if action == "pre_clear":
+        instance._usuarios_afectados = set(
+            sender.objects.filter(habilidad_id=instance.pk).values_list("usuario_id", flat=True)
+        )
+    elif action == "post_clear":
+        programar_cambio_habilidades(getattr(instance, "_usuarios_afectados", set()))
+    elif action in {"post_add", "post_remove"}:
+        programar_cambio_habilidades(pk_set)
 
-@receiver(post_save, sender=SolicitudMatch)
-def notificar_respuesta_solicitud_match(sender, instance, created, **kwargs):
+
+@receiver(pre_delete, sender=Habilidad)
+def cache_usuarios_de_habilidad(sender, instance, **kwargs):
+    instance._usuarios_afectados = set(
+        instance.usuarios_que_saben.values_list("pk", flat=True)
+    ) | set(instance.usuarios_que_quieren_aprender.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Habilidad)
+def actualizar_coincidencias_habilidad_eliminada(sender, instance, **kwargs):
+    usuario_ids = getattr(instance, "_usuarios_afectados", set())
+    programar_recalculo(usuario_ids)
+    invalidar_catalogo(COINCIDENCIAS)
+    transaction.on_commit(motor.invalidar)
+    transaction.on_commit(lambda: indexar_usuarios(usuario_ids))
+
+
+@receiver(post_save, sender=Habilidad)
+def reindexar_habilidad_renombrada(sender, instance, created, **kwargs):
     if created:
         return
+    usuario_ids = set(instance.usuarios_que_saben.values_list("pk", flat=True)) | set(
+        instance.usuarios_que_quieren_aprender.values_list("pk", flat=True)
+    )
+    transaction.on_commit(lambda: indexar_usuarios(usuario_ids))
 
-    estado_previo = getattr(instance, "_estado_previo", None)
-    if estado_previo == instance.estado:
-        return
 
-    if instance.estado == SolicitudMatchEstado.ACEPTADO:
-        titulo = f"{instance.recipiente} aceptó tu solicitud de match"
-    elif instance.estado == SolicitudMatchEstado.RECHAZADO:
-        titulo = f"{instance.recipiente} rechazó tu solicitud de match"
-    else:
+@receiver(post_save, sender=Usuario)
+def actualizar_datos_de_busqueda(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not CAMPOS_BUSQUEDA & set(update_fields):
         return
+    usuario_id = instance.pk
+    transaction.on_commit(lambda: indexar_usuarios({usuario_id}))
+    if not created:
+        avisar_al_motor(lambda version: motor.actualizar_nombre(usuario_id, instance.nombre, version))
 
-    Notificacion.objects.create(
-        titulo=titulo,
-        tipo=NotificacionTipo.SOLICITUD_MATCH,
-        contexto=instance,
-        usuario=instance.emisor,
-        mostrar=True,
-    )
+
+@receiver(post_delete, sender=Usuario)
+def quitar_usuario_del_motor(sender, instance, **kwargs):
+    usuario_id = instance.pk
+    avisar_al_motor(lambda version: motor.quitar_usuario(usuario_id, version))
+
+
+@receiver(post_save, sender=Habilidad)
+@receiver(post_delete, sender=Habilidad)
+def invalidar_catalogo_habilidades(sender, **kwargs):
+    invalidar_catalogo(HABILIDADES)
+
+
+@receiver(post_save, sender=TipoHabilidad)
+@receiver(post_delete, sender=TipoHabilidad)
+def invalidar_catalogo_tipos(sender, **kwargs):
+    # nombre_tipo forma parte de cada habilidad serializada.
+    invalidar_catalogo(TIPOS_HABILIDAD, HABILIDADES)
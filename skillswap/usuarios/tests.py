@@ -1,3 +1,322 @@
-from django.test import TestCase
+import random
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db.models import Count, F, Q
+from django.db.models.query import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import bandeja_salida
+from .models import (
+    EVENTO_SOLICITUD_CREADA,
+    EVENTO_SOLICITUD_RESPONDIDA,
+    CoincidenciaUsuario,
+    EventoSalida,
+    Habilidad,
+    Notificacion,
+    SolicitudMatch,
+    SolicitudMatchEstado,
+    TipoHabilidad,
+    Usuario,
+)
+from .motor_coincidencias import motor
+from .pagination import BusquedaCursorPagination, CoincidenciaCursorPagination
+
+
+def coincidencias_agregadas(usuario):
+    """Candidatos de `usuario` con la consulta COUNT original, que sirve de referencia."""
+    sabe = list(usuario.habilidades_que_se_saben.values_list("pk", flat=True))
+    quiere = list(usuario.habilidades_por_aprender.values_list("pk", flat=True))
+    candidatos = (
+        Usuario.objects.exclude(pk=usuario.pk)
+        .annotate(
+            puede_ensenar=Count("habilidades_que_se_saben", filter=Q(habilidades_que_se_saben__in=quiere), distinct=True),
+            puede_aprender=Count("habilidades_por_aprender", filter=Q(habilidades_por_aprender__in=sabe), distinct=True),
+        )
+        .filter(Q(puede_ensenar__gt=0) | Q(puede_aprender__gt=0))
+        .annotate(total_coincidencias=F("puede_ensenar") + F("puede_aprender"))
+        .order_by("-total_coincidencias", "-puede_ensenar", "-puede_aprender", "nombre", "id")
+    )
+    return [(candidato.pk, candidato.puede_ensenar, candidato.puede_aprender) for candidato in candidatos]
+
+
+class DatosCoincidenciasMixin:
+    def setUp(self):
+        self.azar = random.Random(7)
+        tipo = TipoHabilidad.objects.create(nombre="General")
+        self.habilidades = [Habilidad.objects.create(nombre_habilidad=f"h{i}", tipo=tipo) for i in range(12)]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.usuarios = [
+                Usuario.objects.create_user(email=f"u{i}@example.com", nombre=f"n{i % 5}", apellido="a")
+                for i in range(25)
+            ]
+            for usuario in self.usuarios:
+                usuario.habilidades_que_se_saben.set(self.azar.sample(self.habilidades, self.azar.randint(0, 4)))
+                usuario.habilidades_por_aprender.set(self.azar.sample(self.habilidades, self.azar.randint(0, 4)))
+
+    def cambiar_habilidades(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.habilidades[0].usuarios_que_saben.add(*self.usuarios[:10])
+            self.habilidades[1].usuarios_que_quieren_aprender.clear()
+            self.usuarios[3].habilidades_que_se_saben.clear()
+            self.usuarios[4].habilidades_por_aprender.remove(*self.habilidades[:6])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.habilidades[2].delete()
+            self.usuarios.pop(5).delete()
+
+
+class CoincidenciaUsuarioTests(DatosCoincidenciasMixin, TestCase):
+    def tabla(self, usuario):
+        filas = CoincidenciaUsuario.objects.filter(usuario=usuario).order_by(
+            "-total_coincidencias", "-puede_ensenar", "-puede_aprender", "candidato__nombre", "candidato_id"
+        )
+        return [(fila.candidato_id, fila.puede_ensenar, fila.puede_aprender) for fila in filas]
+
+    def test_tabla_coincide_con_el_agregado(self):
+        for usuario in self.usuarios:
+            self.assertEqual(self.tabla(usuario), coincidencias_agregadas(usuario))
+
+    def test_tabla_sigue_los_cambios_de_habilidades(self):
+        self.cambiar_habilidades()
+        for usuario in self.usuarios:
+            self.assertEqual(self.tabla(usuario), coincidencias_agregadas(usuario))
+
+    def test_endpoint_usa_la_tabla(self):
+        usuario = self.usuarios[0]
+        self.client.force_login(usuario)
+        respuesta = self.client.get("/api/usuarios/coincidencias/")
+        self.assertEqual(respuesta.status_code, 200)
+        esperado = coincidencias_agregadas(usuario)
+        self.assertTrue(esperado)
+        self.assertEqual([fila["id"] for fila in respuesta.json()], [candidato_id for candidato_id, _, _ in esperado])
+
+
+@override_settings(COINCIDENCIAS_BACKEND="memoria")
+class MotorCoincidenciasTests(DatosCoincidenciasMixin, TestCase):
+    def setUp(self):
+        motor.invalidar()
+        self.addCleanup(motor.invalidar)
+        super().setUp()
+
+    def ranking(self, usuario):
+        return [(fila.id, fila.puede_ensenar, fila.puede_aprender) for fila in motor.coincidencias(usuario.pk)]
+
+    def test_motor_coincide_con_el_agregado(self):
+        for usuario in self.usuarios:
+            self.assertEqual(self.ranking(usuario), coincidencias_agregadas(usuario))
+
+    def test_motor_aplica_los_cambios_de_habilidades(self):
+        motor.coincidencias(self.usuarios[0].pk)
+        with mock.patch.object(motor, "_construir", wraps=motor._construir) as construir:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.habilidades[0].usuarios_que_saben.add(*self.usuarios[:10])
+                self.usuarios[3].habilidades_que_se_saben.clear()
+            for usuario in self.usuarios:
+                self.assertEqual(self.ranking(usuario), coincidencias_agregadas(usuario))
+        construir.assert_not_called()
+
+        self.cambiar_habilidades()
+        for usuario in self.usuarios:
+            self.assertEqual(self.ranking(usuario), coincidencias_agregadas(usuario))
+
+    def test_motor_ve_los_cambios_de_otro_proceso(self):
+        motor.coincidencias(self.usuarios[0].pk)
+        # El delta se aplica en otro worker: aquí solo cambia la versión compartida.
+        with mock.patch.object(motor, "actualizar_usuarios"), mock.patch.object(motor, "quitar_usuario"):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.habilidades[0].usuarios_que_saben.add(*self.usuarios[:10])
+                self.usuarios[-1].delete()
+        with mock.patch.object(motor, "_construir", wraps=motor._construir) as construir:
+            for usuario in self.usuarios[:-1]:
+                self.assertEqual(self.ranking(usuario), coincidencias_agregadas(usuario))
+        construir.assert_called_once()
+
+    def test_endpoint_usa_el_motor(self):
+        usuario = self.usuarios[0]
+        self.client.force_login(usuario)
+        respuesta = self.client.get("/api/usuarios/coincidencias/")
+        self.assertEqual(respuesta.status_code, 200)
+        esperado = coincidencias_agregadas(usuario)
+        self.assertTrue(esperado)
+        self.assertEqual([fila["id"] for fila in respuesta.json()], [candidato_id for candidato_id, _, _ in esperado])
+
+
+class PaginacionCursorTests(DatosCoincidenciasMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuarios[0])
+
+    def recorrer(self, url, limite=4):
+        ids, siguiente = [], f"{url}&limit={limite}" if "?" in url else f"{url}?limit={limite}"
+        while siguiente:
+            datos = self.client.get(siguiente).json()
+            self.assertLessEqual(len(datos["results"]), limite)
+            ids += [fila["id"] for fila in datos["results"]]
+            siguiente = datos["next"]
+        return ids
+
+    def test_coincidencias_por_paginas(self):
+        for backend in ("tabla", "memoria"):
+            with self.subTest(backend=backend), override_settings(COINCIDENCIAS_BACKEND=backend):
+                motor.invalidar()
+                completa = [fila["id"] for fila in self.client.get("/api/usuarios/coincidencias/").json()]
+                self.assertGreater(len(completa), 4)
+                self.assertEqual(self.recorrer("/api/usuarios/coincidencias/"), completa)
+        motor.invalidar()
+
+    def test_buscar_por_paginas(self):
+        completa = [fila["id"] for fila in self.client.get("/api/usuarios/buscar/?q=a").json()]
+        self.assertEqual(len(completa), len(self.usuarios))
+        self.assertEqual(self.recorrer("/api/usuarios/buscar/?q=a"), completa)
+
+    def test_cursor_adulterado(self):
+        casos = {
+            "/api/usuarios/coincidencias/": (CoincidenciaCursorPagination(), [2, 1, 1, "n1", 3]),
+            "/api/usuarios/buscar/?q=a": (BusquedaCursorPagination(), [1.5, 3]),
+        }
+        for url, (paginacion, valido) in casos.items():
+            separador = "&" if "?" in url else "?"
+            self.assertEqual(
+                self.client.get(f"{url}{separador}cursor={paginacion.encode_cursor(valido)}").status_code, 200
+            )
+            adulterados = [
+                "no-es-un-cursor!",
+                paginacion.encode_cursor(valido[:-1]),
+                paginacion.encode_cursor({"id": 3}),
+                paginacion.encode_cursor(["x"] * len(valido)),
+                paginacion.encode_cursor([True] * len(valido)),
+                paginacion.encode_cursor(valido[:-1] + ["3"]),
+            ]
+            for cursor in adulterados:
+                with self.subTest(url=url, cursor=cursor):
+                    self.assertEqual(self.client.get(f"{url}{separador}cursor={cursor}").status_code, 404)
+
+
+class RespuestaSolicitudTests(TestCase):
+    def setUp(self):
+        self.emisor = Usuario.objects.create_user(email="emisor@example.com", nombre="Emisor", apellido="a")
+        self.recipiente = Usuario.objects.create_user(email="recipiente@example.com", nombre="Recipiente", apellido="a")
+        self.solicitud = SolicitudMatch.objects.create(emisor=self.emisor, recipiente=self.recipiente)
+
+    def eventos_respuesta(self):
+        return EventoSalida.objects.filter(tipo=EVENTO_SOLICITUD_RESPONDIDA).count()
+
+    def test_aceptar_dos_veces_responde_una(self):
+        self.assertTrue(self.solicitud.aceptar())
+        self.assertFalse(self.solicitud.aceptar())
+        self.assertEqual(self.solicitud.estado, SolicitudMatchEstado.ACEPTADO)
+        self.assertEqual(self.eventos_respuesta(), 1)
+        self.assertEqual(list(self.emisor.matches.all()), [self.recipiente])
+        self.assertEqual(list(self.recipiente.matches.all()), [self.emisor])
+
+    def test_copia_desactualizada_no_pisa_la_respuesta(self):
+        copia = SolicitudMatch.objects.get(pk=self.solicitud.pk)
+        self.assertTrue(self.solicitud.aceptar())
+        self.assertFalse(copia.rechazar())
+        self.assertEqual(copia.estado, SolicitudMatchEstado.ACEPTADO)
+        self.solicitud.refresh_from_db()
+        self.assertEqual(self.solicitud.estado, SolicitudMatchEstado.ACEPTADO)
+        self.assertEqual(self.eventos_respuesta(), 1)
+
+    def test_endpoint_aceptar_es_idempotente(self):
+        self.client.force_login(self.recipiente)
+        url = f"/api/solicitudes-match/{self.solicitud.pk}/aceptar/"
+        for _ in range(2):
+            respuesta = self.client.post(url)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta.json()["estado"], SolicitudMatchEstado.ACEPTADO)
+        self.assertEqual(self.eventos_respuesta(), 1)
+        self.assertEqual(self.emisor.matches.count(), 1)
+
+    def test_en_lote_omite_las_ya_respondidas(self):
+        self.solicitud.rechazar()
+        otro = Usuario.objects.create_user(email="otro@example.com", nombre="Otro", apellido="a")
+        pendiente = SolicitudMatch.objects.create(emisor=otro, recipiente=self.recipiente)
+        respondidas = SolicitudMatch.responder_en_lote(
+            self.recipiente, [self.solicitud.pk, pendiente.pk], SolicitudMatchEstado.ACEPTADO
+        )
+        self.assertEqual(respondidas, [pendiente.pk])
+        self.solicitud.refresh_from_db()
+        self.assertEqual(self.solicitud.estado, SolicitudMatchEstado.RECHAZADO)
+        self.assertEqual(self.emisor.matches.count(), 0)
+        self.assertEqual(list(otro.matches.all()), [self.recipiente])
+        self.assertEqual(self.eventos_respuesta(), 2)
+
+    def test_en_lote_no_pisa_una_respuesta_concurrente(self):
+        # Simula otra petición que responde entre el SELECT y el UPDATE, como puede
+        # pasar en SQLite, donde select_for_update no bloquea.
+        values_list = QuerySet.values_list
+
+        def responder_entremedio(queryset, *campos, **opciones):
+            filas = list(values_list(queryset, *campos, **opciones))
+            if queryset.query.select_for_update:
+                SolicitudMatch.objects.filter(pk=self.solicitud.pk).update(estado=SolicitudMatchEstado.RECHAZADO)
+            return filas
+
+        with mock.patch.object(QuerySet, "values_list", responder_entremedio):
+            respondidas = SolicitudMatch.responder_en_lote(
+                self.recipiente, [self.solicitud.pk], SolicitudMatchEstado.ACEPTADO
+            )
+        self.assertEqual(respondidas, [])
+        self.solicitud.refresh_from_db()
+        self.assertEqual(self.solicitud.estado, SolicitudMatchEstado.RECHAZADO)
+        self.assertEqual(self.emisor.matches.count(), 0)
+        self.assertEqual(self.eventos_respuesta(), 0)
+
+
+@override_settings(BANDEJA_SALIDA_ESPERA=30, BANDEJA_SALIDA_MAX_INTENTOS=3, BANDEJA_SALIDA_PLAZO=300)
+class BandejaSalidaTests(TestCase):
+    def setUp(self):
+        self.recipiente = Usuario.objects.create_user(email="recipiente@example.com", nombre="Recipiente", apellido="a")
+        self.solicitudes = [
+            SolicitudMatch.objects.create(
+                emisor=Usuario.objects.create_user(email=f"e{i}@example.com", nombre=f"E{i}", apellido="a"),
+                recipiente=self.recipiente,
+            )
+            for i in range(3)
+        ]
+        self.eventos = list(EventoSalida.objects.filter(tipo=EVENTO_SOLICITUD_CREADA).order_by("id"))
+        self.fallida = self.eventos[1]
+
+    def manejador_con_falla(self, eventos):
+        if any(evento.pk == self.fallida.pk for evento in eventos):
+            raise RuntimeError("falla de prueba")
+        bandeja_salida.notificar_solicitudes_creadas(eventos)
+
+    def procesar(self, eventos):
+        manejadores = {EVENTO_SOLICITUD_CREADA: (self.manejador_con_falla, True)}
+        with mock.patch.dict(bandeja_salida.MANEJADORES, manejadores), self.assertLogs(bandeja_salida.logger, "ERROR"):
+            return bandeja_salida.procesar_grupo(EVENTO_SOLICITUD_CREADA, eventos)
+
+    def test_reclamar_aparta_los_eventos(self):
+        reclamados = bandeja_salida.reclamar(10)
+        self.assertEqual([evento.pk for evento in reclamados], [evento.pk for evento in self.eventos])
+        self.assertEqual(bandeja_salida.reclamar(10), [])
+        for evento in EventoSalida.objects.all():
+            self.assertGreater(evento.disponible_en, timezone.now() + timedelta(seconds=290))
+
+    def test_un_evento_fallido_no_frena_al_resto(self):
+        self.assertEqual(self.procesar(bandeja_salida.reclamar(10)), 1)
+        self.assertEqual(list(EventoSalida.objects.values_list("pk", flat=True)), [self.fallida.pk])
+        self.assertEqual(Notificacion.objects.filter(usuario=self.recipiente).count(), 2)
+
+        evento = EventoSalida.objects.get()
+        self.assertEqual(evento.intentos, 1)
+        self.assertIn("falla de prueba", evento.error)
+        espera = evento.disponible_en - timezone.now()
+        self.assertTrue(timedelta(seconds=25) < espera <= timedelta(seconds=30))
+
+    def test_reintentos_con_espera_creciente_hasta_apartarlo(self):
+        esperas = []
+        for _ in range(3):
+            EventoSalida.objects.update(disponible_en=timezone.now())
+            self.procesar(bandeja_salida.reclamar(10))
+            evento = EventoSalida.objects.get()
+            if evento.disponible_en is not None:
+                esperas.append(round((evento.disponible_en - timezone.now()).total_seconds() / 10) * 10)
+
+        self.assertEqual(esperas, [30, 60])
+        self.assertEqual(evento.intentos, 3)
+        self.assertIsNone(evento.disponible_en)
+        self.assertEqual(bandeja_salida.reclamar(10), [])
@@ -2,14 +2,17 @@ from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import MethodNotAllowed, ValidationError
 from rest_framework.response import Response
-from django.db.models import Count, Q, F
+from django.db import IntegrityError, transaction
+from django.db.models import Q, F
 from .models import (
     Usuario,
     Habilidad,
     TipoHabilidad,
     ValoracionUsuario,
     SolicitudMatch,
+    SolicitudMatchEstado,
     Notificacion,
 )
 from .serializers import (
@@ -19,8 +22,15 @@ from .serializers import (
     TipoHabilidadSerializer,
     ValoracionUsuarioSerializer,
     SolicitudMatchSerializer,
+    RespuestaSolicitudesSerializer,
     NotificacionSerializer,
+    MarcarLeidasSerializer,
 )
+from .autocompletado import MAX_SUGERENCIAS, indice_habilidades
+from .busqueda import buscar_usuarios
+from .catalogo import HABILIDADES, TIPOS_HABILIDAD, CatalogoCacheMixin
+from .motor_coincidencias import motor, usar_motor_en_memoria
+from .pagination import BusquedaCursorPagination, CoincidenciaCursorPagination
 
 # Create your views here.
 class UsuarioViewset(viewsets.ModelViewSet):
@@ -33,32 +43,45 @@ class UsuarioViewset(viewsets.ModelViewSet):
             return UsuarioCoincidenciaSerializer
         return super().get_serializer_class()
 
-    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated])
+    def get_serializer_context(self):
+        contexto = super().get_serializer_context()
+        if self.request is not None and self.request.method == "GET":
+            params = self.request.query_params
+            contexto["campos"] = [campo for campo in params.get("fields", "").split(",") if campo]
+            contexto["expandir"] = [campo for campo in params.get("expand", "").split(",") if campo]
+        return contexto
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in {"list", "retrieve"}:
+            queryset = self.planificar_consulta(queryset)
+        return queryset
+
+    def planificar_consulta(self, queryset, *columnas_extra):
+        """Limita la consulta a lo que pide el serializer según `fields`/`expand`."""
+        columnas, prefetch = self.get_serializer().get_plan_consulta()
+        return queryset.only(*columnas, *columnas_extra).prefetch_related(*prefetch)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[IsAuthenticated],
+        pagination_class=CoincidenciaCursorPagination,
+    )
     def coincidencias(self, request):
         usuario = request.user
-        habilidades_que_sabe = list(usuario.habilidades_que_se_saben.values_list("pk", flat=True))
-        habilidades_por_aprender = list(usuario.habilidades_por_aprender.values_list("pk", flat=True))
-
-        if not habilidades_que_sabe and not habilidades_por_aprender:
-            return Response([])
+        if usar_motor_en_memoria():
+            return self._coincidencias_en_memoria(usuario)
 
         usuarios_compatibles = (
-            Usuario.objects.exclude(pk=usuario.pk)
+            self.planificar_consulta(Usuario.objects.all(), "nombre")
+            .filter(coincidencias_como_candidato__usuario=usuario)
             .annotate(
-                puede_ensenar=Count(
-                    "habilidades_que_se_saben",
-                    filter=Q(habilidades_que_se_saben__in=habilidades_por_aprender),
-                    distinct=True,
-                ),
-                puede_aprender=Count(
-                    "habilidades_por_aprender",
-                    filter=Q(habilidades_por_aprender__in=habilidades_que_sabe),
-                    distinct=True,
-                ),
+                puede_ensenar=F("coincidencias_como_candidato__puede_ensenar"),
+                puede_aprender=F("coincidencias_como_candidato__puede_aprender"),
+                total_coincidencias=F("coincidencias_como_candidato__total_coincidencias"),
             )
-            .filter(Q(puede_ensenar__gt=0) | Q(puede_aprender__gt=0))
-            .annotate(total_coincidencias=F("puede_ensenar") + F("puede_aprender"))
-            .order_by("-total_coincidencias", "-puede_ensenar", "-puede_aprender", "nombre")
+            .order_by("-total_coincidencias", "-puede_ensenar", "-puede_aprender", "nombre", "id")
         )
 
         pagina = self.paginate_queryset(usuarios_compatibles)
@@ -69,43 +92,87 @@ class UsuarioViewset(viewsets.ModelViewSet):
         serializer = self.get_serializer(usuarios_compatibles, many=True)
         return Response(serializer.data)
 
-    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated], url_path="buscar")
+    def _coincidencias_en_memoria(self, usuario):
+        ranking = motor.coincidencias(usuario.pk)
+        pagina = self.paginate_queryset(ranking)
+        if pagina is not None:
+            serializer = self.get_serializer(self._usuarios_del_ranking(pagina), many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(self._usuarios_del_ranking(ranking), many=True)
+        return Response(serializer.data)
+
+    def _usuarios_del_ranking(self, ranking):
+        usuarios = self.planificar_consulta(Usuario.objects.all(), "nombre").in_bulk(
+            [fila.id for fila in ranking]
+        )
+        resultado = []
+        for fila in ranking:
+            candidato = usuarios.get(fila.id)
+            if candidato is None:
+                continue
+            candidato.puede_ensenar = fila.puede_ensenar
+            candidato.puede_aprender = fila.puede_aprender
+            candidato.total_coincidencias = fila.total_coincidencias
+            resultado.append(candidato)
+        return resultado
+
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[IsAuthenticated],
+        url_path="buscar",
+        pagination_class=BusquedaCursorPagination,
+    )
     def buscar(self, request):
         termino = request.query_params.get("q", "").strip()
 
         if not termino:
             return Response({"detail": "Proporciona un término de búsqueda en 'q'."}, status=400)
 
-        usuarios_filtrados = (
-            self.get_queryset()
-            .filter(
-                Q(nombre__icontains=termino)
-                | Q(segundo_nombre__icontains=termino)
-                | Q(apellido__icontains=termino)
-                | Q(habilidades_que_se_saben__nombre_habilidad__icontains=termino)
-                | Q(habilidades_por_aprender__nombre_habilidad__icontains=termino)
-            )
-            .distinct()
-        )
-
-        pagina = self.paginate_queryset(usuarios_filtrados)
+        resultados = buscar_usuarios(termino)
+        pagina = self.paginate_queryset(resultados)
         if pagina is not None:
-            serializer = self.get_serializer(pagina, many=True)
+            serializer = self.get_serializer(self._usuarios_de_busqueda(pagina), many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(usuarios_filtrados, many=True)
-        return Response(serializer.data)
+        serializer = self.get_serializer(self._usuarios_de_busqueda(resultados), many=True)
+        respuesta = Response(serializer.data)
+        if resultados.truncado:
+            respuesta["X-Resultados-Truncados"] = "true"
+        return respuesta
+
+    def _usuarios_de_busqueda(self, resultados):
+        usuarios = self.planificar_consulta(self.get_queryset()).in_bulk(
+            [resultado.id for resultado in resultados]
+        )
+        return [usuarios[resultado.id] for resultado in resultados if resultado.id in usuarios]
 
-class HabilidadViewset(viewsets.ModelViewSet):
-    queryset = Habilidad.objects.all()
+class HabilidadViewset(CatalogoCacheMixin, viewsets.ModelViewSet):
+    queryset = Habilidad.objects.select_related("tipo")
     serializer_class = HabilidadSerializer
     permission_classes = [IsAuthenticated]
+    catalogo = HABILIDADES
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAuthenticated], url_path="autocompletar")
+    def autocompletar(self, request):
+        termino = request.query_params.get("q", "").strip()
+        if not termino:
+            return Response({"detail": "Proporciona un término de búsqueda en 'q'."}, status=400)
+
+        try:
+            limite = int(request.query_params.get("limit", 10))
+        except ValueError:
+            limite = 10
+        limite = max(1, min(limite, MAX_SUGERENCIAS))
+        return Response(indice_habilidades.sugerir(termino, limite))
 
 
-class TipoHabilidadViewset(viewsets.ModelViewSet):
+class TipoHabilidadViewset(CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = TipoHabilidad.objects.all()
     serializer_class = TipoHabilidadSerializer
     permission_classes = [IsAuthenticated]
+    catalogo = TIPOS_HABILIDAD
 
 
 class ValoracionUsuarioViewset(viewsets.ModelViewSet):
@@ -127,7 +194,12 @@ class SolicitudMatchViewset(viewsets.ModelViewSet):
         return SolicitudMatch.objects.select_related("emisor", "recipiente").filter(Q(emisor=user) | Q(recipiente=user))
 
     def perform_create(self, serializer):
-        serializer.save(emisor=self.request.user)
+        try:
+            with transaction.atomic():
+                serializer.save(emisor=self.request.user)
+        except IntegrityError:
+            # Otra petición creó la misma solicitud pendiente después de validar.
+            raise ValidationError({"non_field_errors": ["Ya enviaste una solicitud pendiente a este usuario."]})
 
     @action(detail=True, methods=["post"], permission_classes=[IsAuthenticated])
     def aceptar(self, request, pk=None):
@@ -149,11 +221,54 @@ class SolicitudMatchViewset(viewsets.ModelViewSet):
         serializer = self.get_serializer(solicitud)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["post"], permission_classes=[IsAuthenticated])
+    def responder(self, request):
+        """Acepta o rechaza de una vez varias solicitudes recibidas.
+
+        Cuerpo: {"ids": [...], "accion": "aceptar" | "rechazar"}. Las que no son
+        del usuario o ya tenían respuesta vuelven en `omitidas`.
+        """
+        entrada = RespuestaSolicitudesSerializer(data=request.data)
+        entrada.is_valid(raise_exception=True)
+        ids = set(entrada.validated_data["ids"])
+        if entrada.validated_data["accion"] == "aceptar":
+            estado = SolicitudMatchEstado.ACEPTADO
+        else:
+            estado = SolicitudMatchEstado.RECHAZADO
+
+        respondidas = SolicitudMatch.responder_en_lote(request.user, ids, estado)
+        return Response({"respondidas": respondidas, "omitidas": sorted(ids - set(respondidas))})
+
 
 class NotificacionViewset(viewsets.ModelViewSet):
     serializer_class = NotificacionSerializer
     permission_classes = [IsAuthenticated]
-    http_method_names = ["get", "patch", "head", "options"]
+    http_method_names = ["get", "patch", "post", "head", "options"]
 
     def get_queryset(self):
         return Notificacion.objects.select_related("contexto", "contexto__emisor", "contexto__recipiente").filter(usuario=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        # POST solo se habilita para las acciones de marcar leídas.
+        raise MethodNotAllowed(request.method)
+
+    @action(detail=False, methods=["get"], url_path="no-leidas")
+    def no_leidas(self, request):
+        """Cantidad de notificaciones visibles sin leer, para el badge; la resuelve el índice."""
+        total = Notificacion.objects.filter(usuario=request.user, mostrar=True, leido=False).count()
+        return Response({"no_leidas": total})
+
+    @action(detail=False, methods=["post"], url_path="marcar-leidas")
+    def marcar_leidas(self, request):
+        """Marca como leídas las notificaciones `ids` del usuario con un solo UPDATE."""
+        entrada = MarcarLeidasSerializer(data=request.data)
+        entrada.is_valid(raise_exception=True)
+        actualizadas = Notificacion.objects.filter(
+            usuario=request.user, leido=False, pk__in=entrada.validated_data["ids"]
+        ).update(leido=True)
+        return Response({"actualizadas": actualizadas})
+
+    @action(detail=False, methods=["post"], url_path="marcar-todas-leidas")
+    def marcar_todas_leidas(self, request):
+        actualizadas = Notificacion.objects.filter(usuario=request.user, leido=False).update(leido=True)
+        return Response({"actualizadas": actualizadas})